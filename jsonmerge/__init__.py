@@ -1,18 +1,76 @@
 # vim:ts=4 sw=4 expandtab softtabstop=4
 from collections import OrderedDict
-from jsonmerge.jsonvalue import JSONValue
+from jsonmerge.jsonvalue import JSONValue, Path, UNDEF, path_of
+from jsonmerge.plan import MergePlan
 from jsonmerge.resolver import LocalRefResolver
 from jsonmerge import strategies
 from jsonmerge import descenders
+from jsonmerge.descenders import Descend
 from jsonmerge.exceptions import SchemaError, JSONMergeError
 from jsonschema.validators import Draft4Validator
+import copy
+import functools
+import hashlib
+import json
 import logging
+import threading
 import warnings
 
 log = logging.getLogger(name=__name__)
 
 #logging.basicConfig(level=logging.DEBUG)
 
+# Methods that strategies can implement, in order of preference.
+MERGE_INTERFACES = ('merge_steps', 'merge_raw', 'merge')
+GET_SCHEMA_INTERFACES = ('get_schema_steps', 'get_schema')
+
+# Marker returned by Walk._begin() when processing continues with a
+# generator pushed on the stack.
+_PUSHED = object()
+
+try:
+    from jsonschema import _types
+
+    # Type checks from jsonschema that can be replaced with a single
+    # expression.
+    _FAST_TYPE_CHECKS = {
+        _types.is_array: lambda value: isinstance(value, list),
+        _types.is_bool: lambda value: isinstance(value, bool),
+        _types.is_null: lambda value: value is None,
+        _types.is_object: lambda value: isinstance(value, dict),
+    }
+except (ImportError, AttributeError):
+    # jsonschema<3.0.0
+    _FAST_TYPE_CHECKS = {}
+
+def _type_checker(validator):
+    # Return a function that does the same as validator.is_type(). Checks
+    # for types known to the validator's TypeChecker (including any custom
+    # ones) are put in a table in advance, so that a check is a single
+    # dictionary lookup and a call.
+    checker = getattr(validator, 'TYPE_CHECKER', None)
+    checks = getattr(checker, '_type_checkers', None)
+    if checks is None:
+        return validator.is_type
+
+    table = {}
+    for name, fn in checks.items():
+        fast = _FAST_TYPE_CHECKS.get(fn)
+        if fast is None:
+            fast = functools.partial(fn, checker)
+        table[name] = fast
+
+    def is_type(value, type):
+        try:
+            fn = table[type]
+        except (KeyError, TypeError):
+            # Let the validator raise the appropriate exception.
+            return validator.is_type(value, type)
+
+        return fn(value)
+
+    return is_type
+
 class Walk(object):
 
     DESCENDERS = [
@@ -26,6 +84,7 @@ class Walk(object):
         self.merge_options = merge_options
         self.resolver = merger.validator.resolver
         self.lvl = -1
+        self.debug = log.isEnabledFor(logging.DEBUG)
 
         self.descenders = [ cls() for cls in self.DESCENDERS ]
 
@@ -39,51 +98,174 @@ class Walk(object):
         if instance.is_undef():
             return False
 
-        return self.merger.validator.is_type(instance.val, type)
+        return self.merger.is_type(instance.val, type)
 
-    def descend(self, schema, *args):
-        assert isinstance(schema, JSONValue)
+    def run(self, steps, name=None):
+        """Run a steps generator to completion and return its result.
+
+        steps -- Generator, as returned by Strategy.merge_steps() or
+        Strategy.get_schema_steps().
+        name -- Strategy name to add to any JSONMergeError raised.
+        """
         self.lvl += 1
+        return self._run([(steps, name)])
 
-        log.debug("descend: %sschema %s" % (self._indent(), schema.ref,))
+    def _descend(self, step):
+        stack = []
+        rv = self._begin(stack, step)
+        if rv is _PUSHED:
+            rv = self._run(stack)
 
-        if not schema.is_undef():
-            with self.resolver.resolving(schema.ref) as resolved:
-                assert schema.val is resolved
+        return rv
 
-        # backwards compatibility jsonmerge<=1.6.0
-        opts = {'meta': None}
+    def _run(self, stack):
+        # Instead of recursing into deeper levels of the document, strategies
+        # (and descenders) are generators that yield Descend objects. Here we
+        # keep the generators for all levels that are currently being
+        # processed on a stack. This way the depth of the document is not
+        # limited by the Python recursion limit.
+        #
+        # Each item on the stack is a tuple of the generator and the strategy
+        # name.
+        #
+        # An exception from a deeper level is thrown into the generator on
+        # the level above, the same as if walk.descend() raised it.
+        rv = None
+        exc = None
+
+        while stack:
+            steps, name = stack[-1]
+
+            try:
+                if exc is None:
+                    step = steps.send(rv)
+                else:
+                    e, exc = exc, None
+                    step = steps.throw(e)
+            except Exception as e:
+                stack.pop()
+                self.lvl -= 1
+
+                if isinstance(e, JSONMergeError) and e.strategy_name is None:
+                    e.strategy_name = name
+
+                if not stack:
+                    raise
+
+                exc = e
+                continue
+
+            if isinstance(step, Descend):
+                try:
+                    rv = self._begin(stack, step)
+                except Exception as e:
+                    exc = e
+                else:
+                    if rv is _PUSHED:
+                        rv = None
+            else:
+                # Generator has yielded the result.
+                stack.pop()
+                self.lvl -= 1
 
-        if not schema.is_undef():
+                steps.close()
+                rv = step
 
-            for descender in self.descenders:
-                rv = self.call_descender(descender, schema, *args)
+        return rv
+
+class WalkInstance(Walk):
+
+    def __init__(self, merger, base, head, merge_options, inplace=False):
+        Walk.__init__(self, merger, merge_options)
+
+        self.plan = merger._get_plan()
+        self.inplace = inplace
+
+    def is_type_raw(self, value, type):
+        """Check if a raw value is a specific JSON type."""
+        if value is UNDEF:
+            return False
+
+        return self.merger.is_type(value, type)
+
+    def descend(self, schema, base, head):
+        assert isinstance(base, JSONValue)
+        assert isinstance(head, JSONValue)
+
+        path = path_of(base, head)
+
+        rv = self.descend_raw(self.plan.node(schema), base.raw(), head.raw(), path)
+        return path.value(rv)
+
+    def descend_raw(self, schema, base, head, path):
+        """Merge raw values head into base.
+
+        schema -- PlanNode for the schema used for merging.
+        base -- Raw value being merged into (UNDEF if undefined).
+        head -- Raw value being merged.
+        path -- Path to base and head in the documents.
+
+        Returns the raw merged value (UNDEF if undefined).
+        """
+        return self._descend(Descend(schema, base, head, path))
+
+    def _begin(self, stack, step):
+        node = self.plan.node(step.schema)
+        base = step.base
+        head = step.head
+        path = step.path
+
+        self.lvl += 1
+
+        if self.debug:
+            log.debug("descend: %sschema %s", self._indent(), node.ref)
+
+        descenders = node.descenders
+        while descenders:
+            for descender in descenders:
+                rv = descender.resolve_instance(self, node, base, head, path)
                 if rv is not None:
-                    self.lvl -= 1
-                    return rv
+                    node = rv
+                    descenders = node.descenders
 
-            name = schema.val.get("mergeStrategy")
+                    if self.debug:
+                        log.debug("descend: %sschema %s", self._indent(), node.ref)
+                    break
+            else:
+                break
 
-            for v in (
-                    self.merge_options.get(name),
-                    schema.val.get("mergeOptions")):
-                if v is not None:
-                    opts.update(v)
+        if self.merge_options:
+            opts = node.options_for(self.merge_options)
         else:
-            name = None
+            opts = node.options
+
+        strategy = node.strategy()
+        if strategy is None:
+            name = self.default_strategy(node, base, head, **opts)
+            try:
+                strategy = self.merger.strategies[name]
+            except KeyError:
+                raise SchemaError("Unknown strategy '%s'" % name, node)
+        else:
+            name = node.strategy_name
 
-        if name is None:
-            name = self.default_strategy(schema, *args, **opts)
+        if self.debug:
+            log.debug("descend: %sinvoke strategy %s", self._indent(), name)
 
-        log.debug("descend: %sinvoke strategy %s" % (self._indent(), name))
+        interface = strategies._interface(strategy, MERGE_INTERFACES)
 
-        try:
-            strategy = self.merger.strategies[name]
-        except KeyError:
-            raise SchemaError("Unknown strategy '%s'" % name, schema)
+        if interface == 'merge_steps':
+            steps = strategy.merge_steps(self, base, head, node, path,
+                    objclass_menu=self.merger.objclass_menu, **opts)
+            stack.append((steps, name))
+            return _PUSHED
 
         try:
-            rv = self.work(strategy, schema, *args, **opts)
+            if interface == 'merge_raw':
+                rv = strategy.merge_raw(self, base, head, node, path,
+                        objclass_menu=self.merger.objclass_menu, **opts)
+            else:
+                rv = self.work_legacy(strategy, node, base, head, path, **opts)
         except JSONMergeError as exc:
             if exc.strategy_name is None:
                 exc.strategy_name = name
@@ -92,43 +274,37 @@ class Walk(object):
         self.lvl -= 1
         return rv
 
-class WalkInstance(Walk):
-
-    def __init__(self, merger, base, head, merge_options):
-        Walk.__init__(self, merger, merge_options)
-        self.base_resolver = LocalRefResolver("", base.val)
-        self.head_resolver = LocalRefResolver("", head.val)
-
     def default_strategy(self, schema, base, head, **kwargs):
-        log.debug("       : %sdefault strategy" % (self._indent(),))
+        if self.debug:
+            log.debug("       : %sdefault strategy", self._indent())
 
         # A different (better?) behavior would be to select default strategy
         # based on head and base like this (see test_merge_default_type_mismatch)
         #
-        #if self.is_type(head, "object") and (base.is_undef() or self.is_type(base, "object")):
+        #if self.is_type_raw(head, "object") and (base is UNDEF or self.is_type_raw(base, "object")):
 
-        if self.is_type(head, "object"):
+        if self.is_type_raw(head, "object"):
             return "objectMerge"
         else:
             return "overwrite"
 
-    def call_descender(self, descender, schema, base, head):
-        return descender.descend_instance(self, schema, base, head)
+    def work_legacy(self, strategy, schema, base, head, path, **kwargs):
+        # Strategies that only implement merge() get JSONValue objects.
+        self.resolver.push_scope(schema.scope)
+        try:
+            rv = self.work(strategy, schema, path.base.value(base), path.value(head), **kwargs)
+        finally:
+            self.resolver.pop_scope()
+
+        return rv.raw()
 
     def work(self, strategy, schema, base, head, **kwargs):
         assert isinstance(schema, JSONValue)
         assert isinstance(base, JSONValue)
         assert isinstance(head, JSONValue)
 
-        log.debug("work   : %sbase %s, head %s" % (self._indent(), base.ref, head.ref))
-
-        if not base.is_undef():
-            with self.base_resolver.resolving(base.ref) as resolved:
-                assert base.val is resolved
-
-        if not head.is_undef():
-            with self.head_resolver.resolving(head.ref) as resolved:
-                assert head.val is resolved
+        if self.debug:
+            log.debug("work   : %sbase %s, head %s", self._indent(), base.ref, head.ref)
 
         rv = strategy.merge(self, base, head, schema, objclass_menu=self.merger.objclass_menu, **kwargs)
 
@@ -137,9 +313,78 @@ class WalkInstance(Walk):
 
 class WalkSchema(Walk):
 
+    def __init__(self, merger, merge_options):
+        super(WalkSchema, self).__init__(merger, merge_options)
+
+        # Results for schemas reached through '$ref', keyed by id() of the
+        # resolved schema. The resolved schema is kept in the value, so that
+        # the id() stays valid.
+        self.ref_results = {}
+
     def is_base_context(self):
         return self.resolver.base_uri == self.merger.schema.get('id', '')
 
+    def descend(self, schema):
+        assert isinstance(schema, JSONValue)
+        return self._descend(Descend(schema))
+
+    def _begin(self, stack, step):
+        schema = step.schema
+        assert isinstance(schema, JSONValue)
+
+        self.lvl += 1
+
+        if self.debug:
+            log.debug("descend: %sschema %s", self._indent(), schema.ref)
+
+        # backwards compatibility jsonmerge<=1.6.0
+        opts = {'meta': None}
+
+        if not schema.is_undef():
+
+            for descender in self.descenders:
+                if descender.applies(schema):
+                    steps = descender.descend_schema(self, schema)
+                    if steps is not None:
+                        stack.append((steps, None))
+                        return _PUSHED
+
+            name = schema.val.get("mergeStrategy")
+
+            for v in (
+                    self.merge_options.get(name),
+                    schema.val.get("mergeOptions")):
+                if v is not None:
+                    opts.update(v)
+        else:
+            name = None
+
+        if name is None:
+            name = self.default_strategy(schema, **opts)
+
+        if self.debug:
+            log.debug("descend: %sinvoke strategy %s", self._indent(), name)
+
+        try:
+            strategy = self.merger.strategies[name]
+        except KeyError:
+            raise SchemaError("Unknown strategy '%s'" % name, schema)
+
+        if strategies._interface(strategy, GET_SCHEMA_INTERFACES) == 'get_schema_steps':
+            steps = strategy.get_schema_steps(self, self._strip(schema), **opts)
+            stack.append((steps, name))
+            return _PUSHED
+
+        try:
+            rv = self.work(strategy, schema, **opts)
+        except JSONMergeError as exc:
+            if exc.strategy_name is None:
+                exc.strategy_name = name
+            raise
+
+        self.lvl -= 1
+        return rv
+
     def resolve_refs(self, schema):
         # For backwards compatibility with jsonmerge <= 1.3.0
         return schema
@@ -152,13 +397,34 @@ class WalkSchema(Walk):
         # to resolve these references in the merge schema,
         # we (ab)use it here to do the same for meta data
         # schema.
-        m = Merger(subschema)
+        #
+        # The same option is often used at many places in the schema, so
+        # results are remembered in the Merger.
+        try:
+            key = json.dumps(subschema, sort_keys=True)
+        except (TypeError, ValueError):
+            key = None
+        else:
+            self.merger._check_schemas()
+            try:
+                return self.merger._option_schemas[key]
+            except KeyError:
+                pass
+
+        m = Merger(subschema, registry=self.merger.registry)
         m.validator.resolver.store.update(self.resolver.store)
 
         w = WalkSchema(m, merge_options={})
-        subschema = w._resolve_refs(JSONValue(subschema), resolve_base=True).val
+        rv = w._resolve_refs(JSONValue(subschema), resolve_base=True).val
+
+        if key is not None:
+            cache = self.merger._option_schemas
+            if len(cache) >= self.merger.MAX_SCHEMAS:
+                cache.clear()
 
-        return subschema
+            cache[key] = rv
+
+        return rv
 
     def _resolve_refs(self, schema, resolve_base=False):
         assert isinstance(schema, JSONValue)
@@ -206,17 +472,16 @@ class WalkSchema(Walk):
         else:
             return "overwrite"
 
-    def call_descender(self, descender, schema):
-        return descender.descend_schema(self, schema)
-
-    def work(self, strategy, schema, **kwargs):
-        assert isinstance(schema, JSONValue)
-
+    def _strip(self, schema):
         schema = JSONValue(dict(schema.val), schema.ref)
         schema.val.pop("mergeStrategy", None)
         schema.val.pop("mergeOptions", None)
+        return schema
+
+    def work(self, strategy, schema, **kwargs):
+        assert isinstance(schema, JSONValue)
 
-        rv = strategy.get_schema(self, schema, **kwargs)
+        rv = strategy.get_schema(self, self._strip(schema), **kwargs)
         assert isinstance(rv, JSONValue)
         return rv
 
@@ -226,14 +491,21 @@ class Merger(object):
         "discard": strategies.Discard(),
         "overwrite": strategies.Overwrite(),
         "version": strategies.Version(),
+        "versionDelta": strategies.VersionDelta(),
         "append": strategies.Append(),
+        "appendUnique": strategies.AppendUnique(),
         "objectMerge": strategies.ObjectMerge(),
         "arrayMergeById": strategies.ArrayMergeById(),
         "arrayMergeByIndex": strategies.ArrayMergeByIndex(),
     }
 
+    # Limit on the number of different merge_options for which the result
+    # of get_schema() is remembered (and the same for schemas given in
+    # options, like metadataSchema).
+    MAX_SCHEMAS = 32
+
     def __init__(self, schema, strategies=(), objclass_def='dict', objclass_menu=None,
-            validatorclass=Draft4Validator):
+            validatorclass=Draft4Validator, registry=None):
         """Create a new Merger object.
 
         schema -- JSON schema to use when merging.
@@ -241,6 +513,7 @@ class Merger(object):
         objclass_def -- Name of the default class for JSON objects.
         objclass_menu -- Any additional classes for JSON objects.
         validatorclass -- JSON Schema validator class.
+        registry -- SchemaRegistry for resolving external references.
 
         strategies argument should be a dict mapping strategy names to
         instances of Strategy subclasses.
@@ -258,16 +531,25 @@ class Merger(object):
         validatorclass argument can be used to supply a validator class from
         jsonschema. This can be used for example to specify which JSON Schema
         draft version will be used during merge.
+
+        registry argument can be used to supply a
+        jsonmerge.registry.SchemaRegistry object. External references in the
+        schema are then resolved from the registry instead of being fetched
+        over the network. References to schemas that are not in the
+        registry (or cached with cache_schema()) fail to resolve.
         """
 
         self.schema = schema
+        self.registry = registry
 
         if hasattr(validatorclass, 'ID_OF'):
-            resolver = LocalRefResolver.from_schema(schema, id_of=validatorclass.ID_OF)
+            resolver = LocalRefResolver.from_schema(schema, id_of=validatorclass.ID_OF,
+                    registry=registry)
         else:
             # jsonschema<3.0.0
-            resolver = LocalRefResolver.from_schema(schema)
+            resolver = LocalRefResolver.from_schema(schema, registry=registry)
         self.validator = validatorclass(schema, resolver=resolver)
+        self.is_type = _type_checker(self.validator)
 
         self.strategies = dict(self.STRATEGIES)
         self.strategies.update(strategies)
@@ -278,6 +560,49 @@ class Merger(object):
 
         self.objclass_menu['_default'] = self.objclass_menu[objclass_def]
 
+        self._plan = None
+        self._schemas = {}
+        self._option_schemas = {}
+        self._schemas_generation = resolver.generation
+
+    def compile(self):
+        """Compile the schema into a merge plan.
+
+        The merge plan holds information about each part of the schema that
+        does not depend on the documents being merged (selected strategies,
+        their options, resolved references, etc.), so that it does not need
+        to be derived again for each merge.
+
+        The plan is built lazily by the merge() method, so calling this
+        method is not required. Calling it in advance moves the cost of
+        processing the schema out of the first merge. It also raises
+        SchemaError for unknown strategies that would otherwise only be
+        reported once a document reaches that part of the schema.
+
+        Returns the merge plan.
+        """
+        plan = self._get_plan()
+        plan.compile()
+        return plan
+
+    def _get_plan(self):
+        # Resolved references in the plan are outdated if the resolver has
+        # been invalidated since the plan was built.
+        if self._plan is None or \
+                self._plan.generation != self.validator.resolver.generation:
+            self._plan = MergePlan(self, WalkInstance.DESCENDERS)
+
+        return self._plan
+
+    def _check_schemas(self):
+        # Same as for the plan, schemas remembered by get_schema() are
+        # outdated if the resolver has been invalidated.
+        generation = self.validator.resolver.generation
+        if self._schemas_generation != generation:
+            self._schemas.clear()
+            self._option_schemas.clear()
+            self._schemas_generation = generation
+
     def cache_schema(self, schema, uri=None):
         """Cache an external schema reference.
 
@@ -302,29 +627,36 @@ class Merger(object):
 
         self.validator.resolver.store.update(((uri, schema),))
 
-    def merge(self, base, head, meta=None, merge_options=None):
+        # Resolved references in the plan and in schemas returned by
+        # get_schema() might now be outdated. They are rebuilt when the
+        # resolver generation changes.
+        self.validator.resolver.invalidate()
+
+    def merge(self, base, head, meta=None, merge_options=None, inplace=False):
         """Merge head into base.
 
         base -- Old JSON document you are merging into.
         head -- New JSON document for merging into base.
         merge_options -- Optional dictionary with merge options.
+        inplace -- If True, modify base instead of making a copy.
 
         Keys of merge_options must be names of the strategies. Values must be
         dictionaries of merge options as in the mergeOptions schema element.
         Options in merge_options are applied to all instances of a strategy.
         Values in schema override values given in merge_options.
 
+        By default, base is left unchanged and containers that are changed by
+        the merge are copied. With inplace set to True, strategies that
+        support it (all built-in strategies do) update objects and arrays in
+        base directly. Parts of head can still end up in the result without
+        being copied, so neither head nor earlier heads should be modified
+        after merging in-place.
+
         Returns an updated base document
         """
 
-        schema = JSONValue(self.schema)
-
         if base is None:
-            base = JSONValue(undef=True)
-        else:
-            base = JSONValue(base)
-
-        head = JSONValue(head)
+            base = UNDEF
 
         if merge_options is None:
             merge_options = {}
@@ -337,8 +669,13 @@ class Merger(object):
 
             merge_options['version'] = { 'metadata': meta }
 
-        walk = WalkInstance(self, base, head, merge_options)
-        return walk.descend(schema, base, head).val
+        walk = WalkInstance(self, base, head, merge_options, inplace)
+        rv = walk.descend_raw(walk.plan.root, base, head, Path())
+
+        if rv is UNDEF:
+            return None
+        else:
+            return rv
 
     def get_schema(self, meta=None, merge_options=None):
         """Get JSON schema for the merged document.
@@ -352,6 +689,12 @@ class Merger(object):
 
         Returns a JSON schema for documents returned by the
         merge() method.
+
+        The schema given to the Merger is not changed. Parts of it that are
+        not affected by merge strategies are shared with the returned
+        schema. The returned schema is remembered for each value of
+        merge_options and returned again by later calls, so it should not
+        be modified.
         """
 
         if merge_options is None:
@@ -364,10 +707,183 @@ class Merger(object):
                     DeprecationWarning, 2)
             merge_options['version'] = { 'metadataSchema': meta }
 
+        try:
+            key = json.dumps(merge_options, sort_keys=True)
+        except (TypeError, ValueError):
+            # Options that can't be serialized (e.g. a HistoryStore) can't
+            # be used as a key.
+            key = None
+        else:
+            self._check_schemas()
+            try:
+                return self._schemas[key]
+            except KeyError:
+                pass
+
         schema = JSONValue(self.schema)
 
         walk = WalkSchema(self, merge_options)
-        return walk.descend(schema).val
+        rv = walk.descend(schema).val
+        rv = _substitute(rv, walk.ref_results)
+
+        if key is not None:
+            if len(self._schemas) >= self.MAX_SCHEMAS:
+                self._schemas.clear()
+
+            self._schemas[key] = rv
+
+        return rv
+
+def _substitute(value, replacements):
+    # Return value with objects substituted as given in replacements (a
+    # dict mapping id() of an object to a tuple of the object and its
+    # substitute). Only objects and arrays that contain a substituted
+    # object are copied. Other parts of value are shared with the result.
+    #
+    # Substitutes can contain further objects that need to be substituted
+    # (e.g. in 'definitions'). Nested values are walked without recursion.
+    if not replacements:
+        return value
+
+    def target(node):
+        seen = set()
+        while id(node) in replacements and id(node) not in seen:
+            seen.add(id(node))
+            original, new = replacements[id(node)]
+            if original is not node:
+                break
+            node = new
+
+        return node
+
+    def is_container(node):
+        return isinstance(node, (dict, list))
+
+    done = {}
+    expanded = set()
+
+    stack = [value]
+    while stack:
+        node = stack[-1]
+        key = id(node)
+
+        if key in done:
+            stack.pop()
+            continue
+
+        t = target(node)
+        if not is_container(t):
+            done[key] = t
+            stack.pop()
+            continue
+
+        if isinstance(t, dict):
+            items = list(t.items())
+        else:
+            items = list(enumerate(t))
+
+        if key not in expanded:
+            expanded.add(key)
+            for k, child in items:
+                if is_container(child) and id(child) not in done and \
+                        id(child) not in expanded:
+                    stack.append(child)
+            continue
+
+        stack.pop()
+
+        new = None
+        for k, child in items:
+            if not is_container(child):
+                continue
+
+            # A child that is not done is an ancestor in a cyclic structure.
+            r = done.get(id(child), child)
+            if r is not child:
+                if new is None:
+                    new = copy.copy(t)
+                new[k] = r
+
+        done[key] = t if new is None else new
+
+    return done[id(value)]
+
+class MergerCache(object):
+    """Cache of Merger objects, keyed by their schema.
+
+    maxsize -- Maximum number of Mergers kept in the cache. When the cache
+    is full, the least recently used Merger is removed.
+
+    The number of lookups that found a Merger in the cache and the number
+    of Mergers created are counted in the hits and misses attributes.
+
+    The cache itself can be used from several threads. A Merger is not
+    thread-safe, so a Merger returned by get() must not be used by several
+    threads at the same time. The merge() function holds a lock for each
+    Merger while merging.
+    """
+
+    def __init__(self, maxsize=128):
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+
+        self._mergers = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, schema, validatorclass=Draft4Validator):
+        """Return a Merger for schema and validatorclass.
+
+        Schemas are identified by a hash of their JSON serialization, so an
+        equal schema returns the same Merger, even if it is a different
+        object. The Merger uses its own copy of the schema. A new Merger is
+        returned each time for schemas that can't be serialized.
+        """
+        return self._get(schema, validatorclass)[0]
+
+    def _get(self, schema, validatorclass=Draft4Validator):
+        # Return a tuple of the Merger and the lock that must be held while
+        # using it.
+        try:
+            s = json.dumps(schema, sort_keys=True, separators=(',', ':'))
+        except (TypeError, ValueError):
+            with self._lock:
+                self.misses += 1
+            return Merger(schema, validatorclass=validatorclass), threading.Lock()
+
+        key = (validatorclass, hashlib.sha256(s.encode('utf-8')).hexdigest())
+
+        with self._lock:
+            entry = self._mergers.pop(key, None)
+            if entry is not None:
+                self.hits += 1
+                self._mergers[key] = entry
+                return entry
+
+            self.misses += 1
+
+        entry = (Merger(json.loads(s), validatorclass=validatorclass), threading.Lock())
+
+        with self._lock:
+            # Another thread might have created a Merger in the meantime.
+            entry = self._mergers.setdefault(key, entry)
+            while len(self._mergers) > self.maxsize:
+                self._mergers.popitem(last=False)
+
+        return entry
+
+    def clear(self):
+        """Remove all Mergers from the cache and reset the counters."""
+        with self._lock:
+            self._mergers.clear()
+            self.hits = 0
+            self.misses = 0
+
+    def __len__(self):
+        return len(self._mergers)
+
+# Cache used by the merge() function.
+merger_cache = MergerCache()
 
 def merge(base, head, schema={}):
     """Merge two JSON documents using strategies defined in schema.
@@ -380,7 +896,11 @@ def merge(base, head, schema={}):
     using the "mergeStrategy" keyword. If not specified, default
     strategy is to use "objectMerge" for objects and "overwrite"
     for all other types.
+
+    Merger objects for schemas are kept in merger_cache. Concurrent calls
+    with the same schema are serialized.
     """
 
-    merger = Merger(schema)
-    return merger.merge(base, head)
+    merger, lock = merger_cache._get(schema)
+    with lock:
+        return merger.merge(base, head)
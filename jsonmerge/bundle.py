@@ -0,0 +1,190 @@
+# vim:ts=4 sw=4 expandtab softtabstop=4
+"""Bundling of merge schemas with external references.
+
+bundle() returns a copy of a schema where each external reference is
+replaced with a reference to a copy of the referenced schema, added to the
+'definitions' keyword of the bundled schema. References between external
+schemas (including cyclic ones) are rewritten the same way, so a Merger can
+use the bundled schema without resolving any external references.
+"""
+import re
+
+from jsonschema.validators import Draft4Validator, urldefrag, urljoin
+
+import jsonmerge
+from jsonmerge.jsonvalue import text_type
+
+# Keywords with values that are not schemas. References in them are left
+# as they are.
+DATA_KEYWORDS = ('enum', 'const', 'default', 'examples')
+
+# Keywords with values that are objects mapping names to schemas.
+SCHEMA_MAP_KEYWORDS = ('properties', 'patternProperties', 'dependencies',
+        'definitions', '$defs')
+
+def bundle(schema, registry=None, schemas=(), validatorclass=Draft4Validator,
+        keyword='definitions'):
+    """Return a copy of schema with external references bundled.
+
+    schema -- Merge schema to bundle.
+    registry -- Optional SchemaRegistry for resolving external references.
+    schemas -- Any external schemas to use, as with Merger.cache_schema().
+    validatorclass -- JSON Schema validator class. This determines the
+    keyword used for ids in the schema.
+    keyword -- Keyword in the bundled schema that holds the external schemas
+    (for example, '$defs' can be used with newer drafts).
+
+    External references are resolved the same way as by a Merger with the
+    given arguments. Ids of subschemas are removed from the bundled schema,
+    since references are rewritten to be relative to its root.
+    """
+    merger = jsonmerge.Merger(schema, validatorclass=validatorclass, registry=registry)
+    for s in schemas:
+        merger.cache_schema(s)
+
+    return _Bundler(merger, keyword).run()
+
+class _Bundler(object):
+
+    def __init__(self, merger, keyword):
+        self.schema = merger.schema
+        self.resolver = merger.validator.resolver
+        self.keyword = keyword
+
+        if hasattr(merger.validator, 'ID_OF'):
+            self.id_of = merger.validator.ID_OF
+        else:
+            # jsonschema<3.0.0
+            self.id_of = lambda schema: schema.get('id', '')
+
+        # Maps URLs of external schemas to their names in the bundle.
+        self.names = {}
+        self.used_names = set()
+
+        # External schemas that still need to be copied.
+        self.pending = []
+
+    def run(self):
+        if not isinstance(self.schema, dict):
+            return self.schema
+
+        existing = self.schema.get(self.keyword)
+        if isinstance(existing, dict):
+            self.used_names.update(existing)
+
+        rv = self.copy(self.schema, self.resolver.resolution_scope, True)
+
+        added = {}
+        while self.pending:
+            name, url, resolved = self.pending.pop()
+            added[name] = self.copy(resolved, url, False)
+
+        if added:
+            definitions = dict(rv.get(self.keyword, {}))
+            definitions.update(added)
+            rv[self.keyword] = definitions
+
+        return rv
+
+    def copy(self, schema, scope, is_root):
+        # Copy schema, rewriting references. Nested schemas are copied
+        # without recursion.
+        out = {}
+
+        # (value, scope, container, key, kind), where kind is 'root',
+        # 'schema' or 'map' (object mapping names to schemas).
+        stack = [(schema, scope, out, 'rv', 'root' if is_root else 'schema')]
+        while stack:
+            value, scope, container, key, kind = stack.pop()
+
+            if isinstance(value, list):
+                new = [None] * len(value)
+                for i, item in enumerate(value):
+                    stack.append((item, scope, new, i, 'schema'))
+                container[key] = new
+
+            elif isinstance(value, dict) and kind == 'map':
+                new = {}
+                for k, v in value.items():
+                    stack.append((v, scope, new, k, 'schema'))
+                container[key] = new
+
+            elif isinstance(value, dict):
+                id_ = self.id_of(value)
+                if not isinstance(id_, (text_type, str)):
+                    id_ = None
+
+                if id_:
+                    scope = urljoin(scope, id_)
+
+                new = {}
+                for k, v in value.items():
+                    if id_ and k in ('id', '$id') and v == id_:
+                        if kind == 'root':
+                            new[k] = v
+                    elif k == '$ref' and isinstance(v, (text_type, str)):
+                        new[k] = self.ref(v, scope)
+                    elif k in DATA_KEYWORDS:
+                        new[k] = v
+                    elif k == 'mergeOptions' and isinstance(v, dict):
+                        options = dict(v)
+                        if 'metadataSchema' in v:
+                            stack.append((v['metadataSchema'], scope, options, 'metadataSchema', 'schema'))
+                        new[k] = options
+                    elif k in SCHEMA_MAP_KEYWORDS and isinstance(v, dict):
+                        stack.append((v, scope, new, k, 'map'))
+                    elif isinstance(v, (dict, list)):
+                        stack.append((v, scope, new, k, 'schema'))
+                    else:
+                        new[k] = v
+                container[key] = new
+
+            else:
+                container[key] = value
+
+        return out['rv']
+
+    def ref(self, ref, scope):
+        url = urljoin(scope, ref)
+        document, fragment = urldefrag(url)
+
+        if document == self.resolver.base_uri and (not fragment or fragment.startswith('/')):
+            # Reference into the schema itself.
+            return '#' + fragment
+
+        if fragment:
+            url = document + '#' + fragment
+        else:
+            url = document
+
+        name = self.names.get(url)
+        if name is None:
+            self.resolver.push_scope(scope)
+            try:
+                resolved_url, resolved = self.resolver.resolve(ref)
+            finally:
+                self.resolver.pop_scope()
+
+            name = self.new_name(url)
+            self.names[url] = name
+            self.pending.append((name, resolved_url, resolved))
+
+        return '#/%s/%s' % (_escape(self.keyword), name)
+
+    def new_name(self, url):
+        document, fragment = urldefrag(url)
+
+        base = document.rstrip('/').rsplit('/', 1)[-1] + fragment
+        base = re.sub(r'[^A-Za-z0-9._-]+', '_', base).strip('_') or 'schema'
+
+        name = base
+        i = 2
+        while name in self.used_names:
+            name = '%s_%d' % (base, i)
+            i += 1
+
+        self.used_names.add(name)
+        return name
+
+def _escape(key):
+    return key.replace('~', '~0').replace('/', '~1')
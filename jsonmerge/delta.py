@@ -0,0 +1,170 @@
+# vim:ts=4 sw=4 expandtab softtabstop=4
+"""Differences between JSON values.
+
+The versionDelta strategy keeps the value of the last version in full and
+stores each older version as a delta against the version that follows it.
+A delta is an object that describes how to get the older value from the
+newer one:
+
+{"replace": value}
+    The older value is value.
+
+{"object": {key: delta, ...}, "remove": [key, ...]}
+    Both values are objects. Properties listed in "remove" are not in the
+    older value. The deltas in "object" apply to the remaining changed
+    properties.
+
+{"items": {index: delta, ...}, "truncate": n, "extend": [value, ...]}
+    Both values are arrays. The newer array is truncated to n elements, the
+    deltas in "items" apply to the changed elements (indexes are strings)
+    and the values in "extend" are appended.
+
+An empty object means that the values are the same.
+
+Values are walked without recursion, so very deeply nested values are
+supported.
+"""
+from jsonmerge.jsonvalue import UNDEF
+
+def _same(a, b):
+    # 1 and 1.0 (or True) are different values in a version history.
+    return type(a) is type(b) and a == b
+
+def diff(old, new):
+    """Return a delta that turns new into old."""
+
+    root = {}
+
+    # Deltas for properties and array items that are the same are removed
+    # in reverse order of creation, so that deltas that become empty in turn
+    # are also removed from their parent.
+    created = []
+
+    stack = [(old, new, root)]
+    while stack:
+        old, new, out = stack.pop()
+
+        if isinstance(old, dict) and isinstance(new, dict):
+            changes = {}
+            for key, value in old.items():
+                if key not in new:
+                    changes[key] = {'replace': value}
+                else:
+                    sub = {}
+                    changes[key] = sub
+                    created.append((changes, key, sub))
+                    stack.append((value, new[key], sub))
+
+            remove = sorted(key for key in new if key not in old)
+
+            out['object'] = changes
+            if remove:
+                out['remove'] = remove
+
+        elif isinstance(old, list) and isinstance(new, list):
+            changes = {}
+            for i in range(min(len(old), len(new))):
+                key = str(i)
+                sub = {}
+                changes[key] = sub
+                created.append((changes, key, sub))
+                stack.append((old[i], new[i], sub))
+
+            out['items'] = changes
+            if len(old) < len(new):
+                out['truncate'] = len(old)
+            elif len(old) > len(new):
+                out['extend'] = old[len(new):]
+
+        elif not _same(old, new):
+            out['replace'] = old
+
+    for changes, key, sub in reversed(created):
+        for k in ('object', 'items'):
+            if k in sub and not sub[k]:
+                del sub[k]
+
+        if not sub:
+            del changes[key]
+
+    for k in ('object', 'items'):
+        if k in root and not root[k]:
+            del root[k]
+
+    return root
+
+def patch(value, delta):
+    """Apply a delta to value and return the result.
+
+    value is not modified. Parts of value that are not changed by the delta
+    are shared with the result.
+    """
+
+    root = [value]
+
+    stack = [(root, 0, delta)]
+    while stack:
+        container, key, delta = stack.pop()
+
+        if 'replace' in delta:
+            container[key] = delta['replace']
+            continue
+
+        if not delta:
+            continue
+
+        value = container[key]
+        if isinstance(value, dict):
+            value = dict(value)
+            for k in delta.get('remove', ()):
+                del value[k]
+
+            for k, sub in delta.get('object', {}).items():
+                stack.append((value, k, sub))
+
+        elif isinstance(value, list):
+            n = delta.get('truncate')
+            if n is None:
+                value = list(value)
+            else:
+                value = value[:n]
+
+            for k, sub in delta.get('items', {}).items():
+                stack.append((value, int(k), sub))
+
+            value.extend(delta.get('extend', ()))
+
+        else:
+            raise ValueError("Delta does not apply to a %s value" % (type(value).__name__,))
+
+        container[key] = value
+
+    return root[0]
+
+def reconstruct(versions):
+    """Return a list of versions with values restored from deltas.
+
+    versions -- Array generated by the versionDelta strategy.
+
+    Entries with a 'delta' property get a 'value' property instead. Other
+    properties (like metadata) are kept. Entries in versions are not
+    modified.
+    """
+
+    rv = []
+    value = UNDEF
+    for entry in reversed(versions):
+        entry = dict(entry)
+        if 'delta' in entry:
+            if value is UNDEF:
+                raise ValueError("Last entry in versions has no 'value' property")
+
+            value = patch(value, entry.pop('delta'))
+            entry['value'] = value
+        else:
+            value = entry['value']
+
+        rv.append(entry)
+
+    rv.reverse()
+    return rv
@@ -1,61 +1,106 @@
 # vim:ts=4 sw=4 expandtab softtabstop=4
 from jsonmerge.exceptions import HeadInstanceError, SchemaError
-from jsonmerge.jsonvalue import JSONValue
+from jsonmerge.jsonvalue import JSONValue, UNDEF, compile_pointer
 import logging
 
 log = logging.getLogger(name=__name__)
 
+class Descend(object):
+    """Request to descend into a deeper level of the document.
+
+    Objects of this class are yielded by Strategy.merge_steps(),
+    Strategy.get_schema_steps() and Descender.descend_schema() generators.
+    The walk processes the deeper level and sends the result back into the
+    generator.
+
+    When merging instances, schema is the PlanNode for the subschema (or a
+    JSONValue), base and head are raw values and path is the Path of the
+    values. When walking the schema, only schema is given.
+    """
+    __slots__ = ('schema', 'base', 'head', 'path')
+
+    def __init__(self, schema, base=None, head=None, path=None):
+        self.schema = schema
+        self.base = base
+        self.head = head
+        self.path = path
+
 class Descender(object):
     """Base class for descender classes.
 
     Descenders are similar to merge strategies, except that they only handle
     recursion into deeper schema structures and don't touch instances.
     """
-    def descend_instance(self, walk, schema, base, head):
+    def applies(self, schema):
+        """Return False if this descender never handles the given schema.
+
+        This is used to skip descenders that do not apply to a schema node
+        when merging instances.
+        """
+        return True
+
+    def resolve_instance(self, walk, schema, base, head, path):
+        """Select the schema to use for merging base into head.
+
+        walk -- WalkInstance object for the current context.
+        schema -- PlanNode for the current schema.
+        base -- Raw value being merged into (UNDEF if undefined).
+        head -- Raw value being merged.
+        path -- Path to base and head in the documents.
+
+        Returns a PlanNode that should be used for merging instead of
+        schema, or None if this descender does not handle the schema.
+        """
         return None
 
     def descend_schema(self, walk, schema):
+        """Descend into subschemas when walking the schema.
+
+        walk -- WalkSchema object for the current context.
+        schema -- JSONValue for the current schema.
+
+        Returns None if this descender does not handle the schema.
+        Otherwise returns a generator that yields Descend objects for
+        subschemas and finally yields the resulting schema.
+        """
         return None
 
 class Ref(Descender):
     def __init__(self):
         self.refs_descended = set('#')
 
-    def descend_instance(self, walk, schema, base, head):
-        ref = schema.val.get("$ref")
-        if ref is None:
-            return None
+    def applies(self, schema):
+        return "$ref" in schema.val
 
-        with walk.resolver.resolving(ref) as resolved:
-            return walk.descend(JSONValue(resolved, ref), base, head)
+    def resolve_instance(self, walk, schema, base, head, path):
+        return schema.ref_target(walk.resolver)
 
     def descend_schema(self, walk, schema):
         ref = schema.val.get("$ref")
-        if ref is None:
-            return None
-
-        if ref in self.refs_descended:
-            return schema
-
-        if walk.resolver.is_remote_ref(ref):
-            return schema
 
-        self.refs_descended.add(ref)
+        if ref in self.refs_descended or walk.resolver.is_remote_ref(ref):
+            yield schema
+        else:
+            self.refs_descended.add(ref)
 
-        with walk.resolver.resolving(ref) as resolved:
+            with walk.resolver.resolving(ref) as resolved:
 
-            rinstance = JSONValue(resolved, ref)
-            if not walk.is_type(rinstance, 'object'):
-                raise SchemaError("'$ref' does not point to an object", schema)
+                rinstance = JSONValue(resolved, ref)
+                if not walk.is_type(rinstance, 'object'):
+                    raise SchemaError("'$ref' does not point to an object", schema)
 
-            result = walk.descend(rinstance)
+                result = yield Descend(rinstance)
 
-            resolved.clear()
-            resolved.update(result.val)
+                # The resolved schema is not changed. The result is put in
+                # its place when the walk is finished.
+                walk.ref_results[id(resolved)] = (resolved, result.val)
 
-        return schema
+            yield schema
 
 class OneOf(Descender):
+    def applies(self, schema):
+        return "oneOf" in schema.val and "mergeStrategy" not in schema.val
+
     def do_descend(self, schema):
         one_of = schema.get("oneOf")
         if one_of.is_undef():
@@ -68,58 +113,136 @@ class OneOf(Descender):
 
         return True
 
-    def descend_instance(self, walk, schema, base, head):
-        if not self.do_descend(schema):
+    def discriminator(self, walk, schema):
+        # Return a tuple with a function that looks up the discriminator,
+        # a dict mapping discriminator values to subschemas and a flag
+        # whether to validate the selected subschema. Returns None if
+        # discriminator is not used.
+        try:
+            return schema.state['discriminator']
+        except KeyError:
+            pass
+
+        ref = schema.options.get('discriminatorRef')
+        if ref is None:
+            rv = None
+        else:
+            mapping = schema.options.get('discriminatorMap')
+            if not walk.is_type_raw(mapping, "object"):
+                raise SchemaError("'discriminatorMap' option does not contain an object", schema)
+
+            one_of = schema.children("oneOf")
+
+            branches = {}
+            for value, i in mapping.items():
+                if not walk.is_type_raw(i, "integer") or not (0 <= i < len(one_of)):
+                    raise SchemaError("'discriminatorMap' value %r is not an index into 'oneOf'" % (i,), schema)
+
+                branches[value] = one_of[i]
+
+            validate = bool(schema.options.get('discriminatorValidate'))
+
+            rv = (compile_pointer(ref), branches, validate)
+
+        schema.state['discriminator'] = rv
+        return rv
+
+    def resolve_discriminated(self, walk, schema, discriminator, base, head, path):
+        # Select the subschema based on the discriminator in head. Returns
+        # None if head does not have a known discriminator value.
+        get, branches, validate = discriminator
+
+        def lookup(v):
+            try:
+                return branches.get(get(v))
+            except TypeError:
+                # unhashable discriminator value
+                return None
+
+        subschema = lookup(head)
+        if subschema is None:
             return None
 
-        one_of = schema.get("oneOf")
+        if base is not UNDEF and lookup(base) is not subschema:
+            raise HeadInstanceError("Discriminator in base and head select different elements of 'oneOf'",
+                    path.value(head))
+
+        if validate and not (subschema.is_valid(head) and subschema.is_valid(base)):
+            raise HeadInstanceError("No element of 'oneOf' validates both base and head", path.value(head))
+
+        return subschema
+
+    def resolve_instance(self, walk, schema, base, head, path):
+        discriminator = self.discriminator(walk, schema)
+        if discriminator is not None:
+            subschema = self.resolve_discriminated(walk, schema, discriminator, base, head, path)
+            if subschema is not None:
+                return subschema
+
+        one_of = schema.children("oneOf")
 
         valid = []
 
-        def is_valid(v, schema):
-            if v.is_undef():
-                return True
-            else:
-                validator = walk.merger.validator
-                if hasattr(validator, 'evolve'):
-                    errors = validator.evolve(schema=schema).iter_errors(v.val)
-                else:
-                    # jsonschema<4.0.0
-                    errors = validator.iter_errors(v.val, schema)
-                return not list(errors)
+        # Subschemas that head can't validate against based on quick checks
+        # are skipped.
+        index = schema.one_of_index()
 
-        for i, subschema in enumerate(one_of):
-            log.debug("oneOf: validating %s" % (subschema.ref,))
+        for i in index.candidates(head):
+            subschema = one_of[i]
 
-            base_valid = is_valid(base, subschema.val)
-            head_valid = is_valid(head, subschema.val)
+            if walk.debug:
+                log.debug("oneOf: validating %s", subschema.ref)
 
-            log.debug("oneOf:   base valid: %s, head valid: %s" % (base_valid, head_valid))
+            # Base is only validated against subschemas that head validates
+            # against.
+            if subschema.is_valid(head):
+                base_valid = index.accepts(i, base) and subschema.is_valid(base)
 
-            if base_valid and head_valid:
-                valid.append(i)
+                if walk.debug:
+                    log.debug("oneOf:   base valid: %s", base_valid)
+
+                if base_valid:
+                    valid.append(i)
+            elif walk.debug:
+                log.debug("oneOf:   head not valid")
 
         if len(valid) == 0:
-            raise HeadInstanceError("No element of 'oneOf' validates both base and head", head)
+            raise HeadInstanceError("No element of 'oneOf' validates both base and head", path.value(head))
 
         if len(valid) > 1:
-            raise HeadInstanceError("Multiple elements of 'oneOf' validate", head)
+            raise HeadInstanceError("Multiple elements of 'oneOf' validate", path.value(head))
 
         i = valid[0]
-        return walk.descend(one_of[i], base, head)
+        return one_of[i]
 
     def descend_schema(self, walk, schema):
         if not self.do_descend(schema):
             return None
 
+        return self._descend_schema(schema)
+
+    def _descend_schema(self, schema):
+        # mergeOptions with discriminator options don't belong into the
+        # resulting schema.
+        schema2 = JSONValue(dict(schema.val), schema.ref)
+        schema2.val.pop("mergeOptions", None)
+
         one_of = schema.get("oneOf")
 
+        items = []
         for i in range(len(one_of.val)):
-            one_of[i] = walk.descend(one_of[i])
+            rv = yield Descend(one_of[i])
+            items.append(rv.val)
 
-        return schema
+        schema2.val["oneOf"] = items
+
+        yield schema2
 
 class AnyOfAllOf(Descender):
+    def applies(self, schema):
+        return ("allOf" in schema.val or "anyOf" in schema.val) and \
+                "mergeStrategy" not in schema.val
+
     def descend(self, schema):
         allOf = schema.get("allOf")
         anyOf = schema.get("anyOf")
@@ -133,7 +256,7 @@ class AnyOfAllOf(Descender):
 
         raise SchemaError("Can't descend to 'allOf' and 'anyOf' keywords", schema)
 
-    def descend_instance(self, walk, schema, base, head):
+    def resolve_instance(self, walk, schema, base, head, path):
         return self.descend(schema)
 
     def descend_schema(self, walk, schema):
@@ -0,0 +1,130 @@
+# vim:ts=4 sw=4 expandtab softtabstop=4
+"""Stores for version history kept outside of the merged document.
+
+With the 'historyStore' option, the version strategy appends each new
+version to a history store, in addition to keeping the last versions in the
+merged document. Versions are identified by a key, given in the 'historyKey'
+option (for example an ID of the document), and the JSON pointer to the
+versioned value in the document.
+"""
+import io
+import json
+import sqlite3
+
+class HistoryStore(object):
+    """Base class for history stores."""
+
+    def append(self, key, ref, entry):
+        """Append a version.
+
+        key -- Value of the 'historyKey' option (can be None).
+        ref -- JSON pointer to the versioned value in the document.
+        entry -- Version, as added to the array in the merged document
+        (object with the value and any metadata).
+        """
+        raise NotImplementedError
+
+    def read(self, key, ref):
+        """Return an iterator over versions for key and ref, oldest first.
+
+        Versions are read from the store as the iterator advances.
+        """
+        raise NotImplementedError
+
+    def count(self, key, ref):
+        """Return the number of versions for key and ref."""
+        n = 0
+        for entry in self.read(key, ref):
+            n += 1
+
+        return n
+
+    def close(self):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+class FileHistoryStore(HistoryStore):
+    """History store in an append-only file.
+
+    Each version is written as a line with a JSON object containing the
+    key, ref and the version. Reading versions scans the whole file.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.f = io.open(path, 'a', encoding='utf-8')
+
+    def append(self, key, ref, entry):
+        line = json.dumps({'key': key, 'ref': ref, 'entry': entry}, sort_keys=True)
+
+        # json.dumps returns str on Python 2 when all characters are ASCII.
+        self.f.write(u'%s\n' % (line,))
+        self.f.flush()
+
+    def read(self, key, ref):
+        with io.open(self.path, 'r', encoding='utf-8') as f:
+            for line in f:
+                record = json.loads(line)
+                if record['key'] == key and record['ref'] == ref:
+                    yield record['entry']
+
+    def close(self):
+        self.f.close()
+
+class SQLiteHistoryStore(HistoryStore):
+    """History store in an SQLite database.
+
+    path -- Path to the database file, or ':memory:'.
+    autocommit -- If False, appended versions are only committed when the
+    commit() method is called.
+    """
+
+    def __init__(self, path, autocommit=True):
+        self.conn = sqlite3.connect(path)
+        self.autocommit = autocommit
+
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS history ("
+            "   seq INTEGER PRIMARY KEY AUTOINCREMENT,"
+            "   key TEXT,"
+            "   ref TEXT NOT NULL,"
+            "   entry TEXT NOT NULL)")
+        self.conn.execute(
+            "CREATE INDEX IF NOT EXISTS history_key_ref "
+            "ON history (key, ref, seq)")
+        self.conn.commit()
+
+    def append(self, key, ref, entry):
+        self.conn.execute(
+            "INSERT INTO history (key, ref, entry) VALUES (?, ?, ?)",
+            (key, ref, json.dumps(entry, sort_keys=True)))
+
+        if self.autocommit:
+            self.conn.commit()
+
+    def read(self, key, ref):
+        cursor = self.conn.execute(
+            "SELECT entry FROM history WHERE key IS ? AND ref = ? ORDER BY seq",
+            (key, ref))
+
+        for row in cursor:
+            yield json.loads(row[0])
+
+    def count(self, key, ref):
+        cursor = self.conn.execute(
+            "SELECT COUNT(*) FROM history WHERE key IS ? AND ref = ?",
+            (key, ref))
+
+        return cursor.fetchone()[0]
+
+    def commit(self):
+        self.conn.commit()
+
+    def close(self):
+        self.conn.commit()
+        self.conn.close()
@@ -1,26 +1,266 @@
 # vim:ts=4 sw=4 expandtab softtabstop=4
+import hashlib
+import json
 import sys
 
 if sys.version_info[0] >= 3:
     text_type = str
+    from urllib.parse import unquote
 else:
     text_type = unicode
+    from urllib import unquote
+
+class Undef(object):
+    """Type of the UNDEF marker."""
+    def __repr__(self):
+        return 'UNDEF'
+
+# Marker for an undefined value, used instead of JSONValue(undef=True) when
+# working with raw values.
+UNDEF = Undef()
+
+def ref_escape(key):
+    return key.replace('~', '~0').replace('/', '~1')
+
+def _compile_pointer(ref):
+    parts = []
+
+    ref = ref.lstrip('/')
+    if ref:
+        for part in unquote(ref).split('/'):
+            part = part.replace('~1', '/').replace('~0', '~')
+
+            try:
+                index = int(part)
+            except ValueError:
+                index = None
+
+            parts.append((part, index))
+
+    def get(value):
+        for part, index in parts:
+            if isinstance(value, (list, tuple)):
+                if index is None:
+                    return UNDEF
+                key = index
+            else:
+                key = part
+
+            try:
+                value = value[key]
+            except (TypeError, LookupError):
+                return UNDEF
+
+        return value
+
+    return get
+
+def _compile_pointers(refs):
+    gets = [ _compile_pointer(ref) for ref in refs ]
+
+    def get(value):
+        rv = []
+        for g in gets:
+            v = g(value)
+            if v is UNDEF:
+                return UNDEF
+            rv.append(v)
+
+        return rv
+
+    return get
+
+_pointers = {}
+
+def compile_pointer(ref):
+    """Return a function that looks up a JSON pointer in a raw value.
+
+    ref -- JSON pointer, or a list of JSON pointers (as in the idRef and
+    sortByRef options).
+
+    The returned function returns the value the pointer refers to, or UNDEF
+    if there is no such value. For a list of pointers, it returns a list of
+    values, or UNDEF if any of them is missing.
+
+    Leading slash in the pointer is optional, as with
+    RefResolver.resolve_fragment(). Compiled functions are cached.
+    """
+    if isinstance(ref, list):
+        key = tuple(ref)
+    else:
+        key = ref
+
+    try:
+        return _pointers[key]
+    except KeyError:
+        pass
+
+    if isinstance(ref, list):
+        get = _compile_pointers(ref)
+    else:
+        get = _compile_pointer(ref)
+
+    if len(_pointers) >= 1000:
+        _pointers.clear()
+
+    _pointers[key] = get
+    return get
+
+def canonical_hash(value):
+    """Return a hash of a raw JSON value.
+
+    The hash is computed from the JSON serialization of the value with
+    sorted object keys, so equal values have equal hashes regardless of
+    the order of keys. Note that, unlike with the == operator, values of
+    different JSON types (e.g. 1 and 1.0, or 1 and true) have different
+    hashes.
+    """
+    s = json.dumps(value, sort_keys=True, separators=(',', ':'))
+    return hashlib.sha256(s.encode('ascii')).hexdigest()
+
+def _build_ref(node):
+    # Build JSON pointer for a Path or JSONValue from the chain of parent
+    # links. This is done without recursion, so that it works for
+    # arbitrarily deep documents.
+    keys = []
+    while node._ref is None:
+        keys.append(node._key)
+        node = node._parent
+
+    parts = [node._ref]
+    for key in reversed(keys):
+        parts.append(ref_escape(text_type(key)))
+
+    return '/'.join(parts)
+
+class Path(object):
+    """Location of a value in a JSON document.
+
+    Path is used instead of JSONValue.ref when working with raw values. Each
+    Path only holds a link to the Path of the parent value and the key of the
+    value in the parent. JSON pointer for the location is only built when the
+    ref attribute is accessed.
+
+    Usually base and head are at the same location. Strategies that merge
+    items at different locations (e.g. arrayMergeById) give the location of
+    the base value separately in the base argument.
+    """
+    __slots__ = ('_parent', '_key', '_ref', '_base')
+
+    def __init__(self, ref='#', parent=None, key=None, base=None):
+        if parent is None:
+            self._ref = ref
+        else:
+            self._ref = None
+
+        self._parent = parent
+        self._key = key
+        self._base = base
+
+    def child(self, key, base_key=None):
+        """Return the Path for an item of this value.
+
+        base_key -- Key of the item in base, if it is different from key.
+        """
+        if base_key is None:
+            base_key = key
+
+        if base_key == key and self._base is None:
+            return Path(parent=self, key=key)
+
+        return Path(parent=self, key=key, base=self.base.child(base_key))
+
+    @property
+    def base(self):
+        """Path of the value in base."""
+        if self._base is None:
+            return self
+        else:
+            return self._base
+
+    @property
+    def ref(self):
+        if self._ref is None:
+            self._ref = _build_ref(self)
+
+        return self._ref
+
+    def value(self, val):
+        """Return a JSONValue for a raw value at this location."""
+        if val is UNDEF:
+            return JSONValue(undef=True, parent=self)
+        else:
+            return JSONValue(val, parent=self)
+
+    def __str__(self):
+        return self.ref
+
+    def __repr__(self):
+        if self._base is None:
+            return 'Path(%r)' % (self.ref,)
+        else:
+            return 'Path(%r, base=%r)' % (self.ref, self._base)
+
+def path_of(base, head):
+    """Return the Path for merging JSONValue head into base."""
+    if head.is_undef():
+        return Path(base.ref)
+    elif base.is_undef() or base.ref == head.ref:
+        return Path(head.ref)
+    else:
+        return Path(head.ref, base=Path(base.ref))
 
 class JSONValue(object):
-    def __init__(self, val=None, ref='#', undef=False):
+    """A value in a JSON document together with its location.
+
+    The location is given either as a JSON pointer in ref, or as a link to
+    the parent JSONValue (or Path) and the key of this value in the parent.
+    In the latter case, the JSON pointer is only built when the ref attribute
+    is accessed. If key is None, the location is the same as parent's.
+    """
+    __slots__ = ('val', 'undef', '_parent', '_key', '_ref')
+
+    def __init__(self, val=None, ref='#', undef=False, parent=None, key=None):
         assert not isinstance(val, JSONValue)
         self.val = val
-        self.ref = ref
         self.undef = undef
 
+        if parent is None:
+            self._ref = ref
+        elif key is None:
+            self._ref = parent._ref
+            parent, key = parent._parent, parent._key
+        else:
+            self._ref = None
+
+        self._parent = parent
+        self._key = key
+
+    @property
+    def ref(self):
+        if self._ref is None:
+            self._ref = _build_ref(self)
+
+        return self._ref
+
+    @ref.setter
+    def ref(self, ref):
+        self._ref = ref
+        self._parent = None
+        self._key = None
+
     def is_undef(self):
         return self.undef
 
-    def _ref_escape(self, key):
-        return key.replace('~', '~0').replace('/', '~1')
+    def raw(self):
+        """Return the raw value, or UNDEF if the value is undefined."""
+        if self.undef:
+            return UNDEF
+        else:
+            return self.val
 
     def _subval(self, key, **kwargs):
-        return JSONValue(ref=self.ref+'/'+self._ref_escape(text_type(key)), **kwargs)
+        return JSONValue(parent=self, key=key, **kwargs)
 
     def __setitem__(self, key, item):
         if item.is_undef():
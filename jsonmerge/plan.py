@@ -0,0 +1,483 @@
+# vim:ts=4 sw=4 expandtab softtabstop=4
+from jsonmerge.exceptions import SchemaError
+from jsonmerge.jsonvalue import JSONValue, UNDEF
+import jsonschema
+import re
+
+class PlanNode(JSONValue):
+    """A node in the schema with pre-computed merge information.
+
+    Plan nodes hold everything about a part of the schema that does not
+    depend on the documents being merged: the explicitly selected strategy,
+    options given in the 'mergeOptions' keyword, descenders that apply to
+    the node, the target of a '$ref' keyword and nodes for subschemas. This
+    information is computed once, when the node is used in a merge for the
+    first time.
+
+    PlanNode is a JSONValue for the schema, so it can be passed on to merge
+    strategies that expect a schema.
+
+    scope is the resolution scope for any references in this part of the
+    schema.
+
+    state is a dictionary where strategies can keep information between
+    merges for this part of the schema.
+    """
+
+    # Limit on the number of object keys for which the subschema is
+    # remembered by property_schema().
+    MAX_PROPERTIES = 1000
+
+    def __init__(self, plan, schema, scope):
+        JSONValue.__init__(self, schema.val, schema.ref, schema.undef)
+
+        self.plan = plan
+        self.scope = scope
+
+        if self.undef or not plan.merger.is_type(self.val, "object"):
+            self.strategy_name = None
+            self.schema_options = None
+            self.descenders = ()
+        else:
+            self.strategy_name = self.val.get("mergeStrategy")
+            self.schema_options = self.val.get("mergeOptions")
+            self.descenders = tuple(
+                    d for d in plan.descenders if d.applies(self))
+
+        # backwards compatibility jsonmerge<=1.6.0
+        self.options = {'meta': None}
+        if self.schema_options is not None:
+            self.options.update(self.schema_options)
+
+        self._strategy = None
+        self._ref_target = None
+        self._children = {}
+
+        self._properties = {}
+        self._validator = None
+
+        self.state = {}
+
+    def strategy(self):
+        """Return the strategy object selected with the 'mergeStrategy'
+        keyword, or None if the node doesn't select a strategy."""
+        if self._strategy is None and self.strategy_name is not None:
+            try:
+                self._strategy = self.plan.merger.strategies[self.strategy_name]
+            except KeyError:
+                raise SchemaError("Unknown strategy '%s'" % self.strategy_name, self)
+
+        return self._strategy
+
+    def options_for(self, merge_options):
+        """Return strategy options for this node, taking into account the
+        merge_options argument given to Merger.merge()."""
+        extra = merge_options.get(self.strategy_name)
+        if extra is None:
+            return self.options
+
+        opts = {'meta': None}
+        opts.update(extra)
+        if self.schema_options is not None:
+            opts.update(self.schema_options)
+
+        return opts
+
+    def ref_target(self, resolver):
+        """Return the plan node for the schema referenced by the '$ref'
+        keyword in this node."""
+        if self._ref_target is None:
+            ref = self.val["$ref"]
+
+            resolver.push_scope(self.scope)
+            try:
+                url, resolved = resolver.resolve(ref)
+            finally:
+                resolver.pop_scope()
+
+            self._ref_target = self.plan.node(JSONValue(resolved, ref), url)
+
+        return self._ref_target
+
+    def is_valid(self, value):
+        """Return True if a raw value validates against this schema.
+
+        UNDEF is considered valid. Validation stops at the first error. The
+        validator for the schema is created on the first call.
+        """
+        if value is UNDEF:
+            return True
+
+        validator = self._validator
+        if validator is None:
+            validator = self.plan.merger.validator
+            if hasattr(validator, 'evolve'):
+                validator = validator.evolve(schema=self.val)
+                self._validator = validator.is_valid
+            else:
+                # jsonschema<4.0.0
+                val = self.val
+                self._validator = lambda v: validator.is_valid(v, val)
+
+            validator = self._validator
+
+        resolver = self.plan.resolver
+        resolver.push_scope(self.scope)
+        try:
+            return validator(value)
+        finally:
+            resolver.pop_scope()
+
+    def one_of_index(self):
+        """Return the OneOfIndex for subschemas under the 'oneOf' keyword."""
+        key = ('_oneOf', None)
+        try:
+            return self._children[key]
+        except KeyError:
+            pass
+
+        index = OneOfIndex(self.plan.merger, self.children("oneOf"))
+
+        self._children[key] = index
+        return index
+
+    def child(self, keyword):
+        """Return the plan node for the subschema under keyword."""
+        try:
+            return self._children[keyword]
+        except KeyError:
+            pass
+
+        if self.undef:
+            node = self.plan.undef
+        else:
+            node = self.plan.node(self.get(keyword), self.scope)
+
+        self._children[keyword] = node
+        return node
+
+    def children(self, keyword):
+        """Return a list of plan nodes for the array of subschemas under
+        keyword."""
+        key = (keyword, None)
+        try:
+            return self._children[key]
+        except KeyError:
+            pass
+
+        nodes = [ self.plan.node(v, self.scope) for v in self[keyword] ]
+
+        self._children[key] = nodes
+        return nodes
+
+    def _object_keywords(self):
+        key = ('_object', None)
+        try:
+            return self._children[key]
+        except KeyError:
+            pass
+
+        properties = self.child('properties')
+
+        patterns = []
+        p = self.child('patternProperties')
+        if not p.undef:
+            for pattern, s in p.items():
+                patterns.append((re.compile(pattern), self.plan.node(s, self.scope)))
+
+        # The last matching pattern is used, so they are tried in reverse.
+        patterns.reverse()
+
+        additional = self.child('additionalProperties')
+        # additionalProperties can be boolean in draft 4
+        if not additional.undef and \
+                not self.plan.merger.is_type(additional.val, "object"):
+            additional = self.plan.undef
+
+        rv = (properties, patterns, additional)
+        self._children[key] = rv
+        return rv
+
+    def property_schema(self, key):
+        """Return the plan node for the value of an object property.
+
+        The subschema is looked up the same way as with JSON schema
+        validation: first in the 'properties' keyword, then in the
+        'patternProperties' and finally in 'additionalProperties'.
+        Results are remembered for up to MAX_PROPERTIES keys.
+        """
+        try:
+            return self._properties[key]
+        except KeyError:
+            pass
+
+        subschema = self._property_schema(key)
+
+        if len(self._properties) >= self.MAX_PROPERTIES:
+            self._properties.clear()
+
+        self._properties[key] = subschema
+        return subschema
+
+    def _property_schema(self, key):
+        if self.undef:
+            return self.plan.undef
+
+        properties, patterns, additional = self._object_keywords()
+
+        if not properties.undef and key in properties.val:
+            return properties.child(key)
+
+        for pattern, subschema in patterns:
+            if pattern.search(key):
+                return subschema
+
+        return additional
+
+class OneOfIndex(object):
+    """Quick checks of values against 'oneOf' subschemas.
+
+    For each subschema, the index holds conditions that any valid value must
+    meet: its type (the 'type' keyword), allowed values ('enum' and
+    'const'), required properties ('required') and the same conditions for
+    values of individual properties ('properties'). Values that don't meet
+    the conditions for a subschema can't validate against it, so there is
+    no need to run the validator. Subschemas with other keywords are still
+    validated as usual for values that meet the conditions.
+
+    If all subschemas require a property with a list of allowed values (an
+    implicit discriminator), subschemas are also indexed by its value.
+    """
+
+    def __init__(self, merger, one_of):
+        self.validator = merger.validator
+        self.is_type = merger.is_type
+        self.conditions = [ self._conditions(s.val, True) for s in one_of ]
+        self.discriminator = self._find_discriminator()
+
+    def _conditions(self, schema, nested):
+        # Return a tuple (types, values, required, properties), or None if
+        # there are no conditions for the schema.
+        if not self.is_type(schema, "object") or "$ref" in schema:
+            # '$ref' overrides other keywords in older drafts.
+            return None
+
+        keywords = self.validator.VALIDATORS
+
+        types = schema.get("type")
+        if "type" not in keywords or types is None:
+            types = None
+        else:
+            if not isinstance(types, list):
+                types = [types]
+
+            try:
+                for t in types:
+                    self.is_type(None, t)
+            except (jsonschema.exceptions.UnknownType, TypeError):
+                # Types given as schemas in draft 3 or unknown types.
+                types = None
+
+        values = []
+        for keyword in ("enum", "const"):
+            if keyword in keywords and keyword in schema:
+                if keyword == "const":
+                    values.append([schema[keyword]])
+                elif isinstance(schema[keyword], list):
+                    values.append(schema[keyword])
+
+        required = schema.get("required")
+        if "required" not in keywords or not isinstance(required, list):
+            required = []
+
+        properties = []
+        p = schema.get("properties")
+        if nested and self.is_type(p, "object"):
+            for k, v in p.items():
+                c = self._conditions(v, False)
+                if c is not None:
+                    properties.append((k, c))
+
+        if types is None and not values and not required and not properties:
+            return None
+
+        return (types, values, required, properties)
+
+    def _find_discriminator(self):
+        # Return a tuple (property name, dict mapping its values to lists of
+        # subschema indexes), or None.
+        candidates = None
+        for c in self.conditions:
+            if c is None:
+                return None
+
+            names = set(k for k, pc in c[3] if pc[1] and k in c[2])
+            if candidates is None:
+                candidates = names
+            else:
+                candidates &= names
+
+        for name in sorted(candidates or ()):
+            mapping = {}
+            try:
+                for i, c in enumerate(self.conditions):
+                    pc = dict(c[3])[name]
+                    for v in pc[1][0]:
+                        l = mapping.setdefault(v, [])
+                        if i not in l:
+                            l.append(i)
+            except TypeError:
+                # unhashable values
+                continue
+
+            return (name, mapping)
+
+        return None
+
+    def _accepts(self, c, value):
+        types, values, required, properties = c
+
+        if types is not None:
+            for t in types:
+                if self.is_type(value, t):
+                    break
+            else:
+                return False
+
+        for allowed in values:
+            if value not in allowed:
+                return False
+
+        if (required or properties) and self.is_type(value, "object"):
+            for k in required:
+                if k not in value:
+                    return False
+
+            for k, pc in properties:
+                if k in value and not self._accepts(pc, value[k]):
+                    return False
+
+        return True
+
+    def accepts(self, i, value):
+        """Return False if value can't validate against subschema i."""
+        c = self.conditions[i]
+        if c is None or value is UNDEF:
+            return True
+        else:
+            return self._accepts(c, value)
+
+    def candidates(self, value):
+        """Return indexes of subschemas that value could validate against."""
+        if value is UNDEF:
+            return range(len(self.conditions))
+
+        if self.discriminator is not None and self.is_type(value, "object"):
+            name, mapping = self.discriminator
+            try:
+                indexes = mapping.get(value.get(name), ())
+            except TypeError:
+                indexes = range(len(self.conditions))
+        else:
+            indexes = range(len(self.conditions))
+
+        return [ i for i in indexes if self.accepts(i, value) ]
+
+class MergePlan(object):
+    """Compiled form of the merge schema.
+
+    MergePlan maps each part of the schema to a PlanNode. Nodes are created
+    lazily, when they are needed for the first time. Since plan nodes are
+    identified by the schema objects they were built from, the plan must
+    be discarded whenever the schema changes. The generation attribute
+    holds the generation of the resolver (see LocalRefResolver.invalidate())
+    that the plan was built for.
+    """
+
+    # Limit on the number of nodes kept in the plan. Strategies can create
+    # new schema objects on the fly, so without a limit the plan could grow
+    # without bound.
+    MAX_NODES = 10000
+
+    def __init__(self, merger, descenders):
+        self.merger = merger
+        self.descenders = [ cls() for cls in descenders ]
+
+        self.resolver = merger.validator.resolver
+        self.generation = self.resolver.generation
+
+        self.nodes = {}
+        self.undef = PlanNode(self, JSONValue(undef=True), None)
+        self.root = PlanNode(self, JSONValue(merger.schema),
+                self.resolver.resolution_scope)
+
+    def node(self, schema, scope=None):
+        """Return the plan node for a schema.
+
+        schema -- JSONValue or PlanNode with a part of the schema.
+        scope -- Resolution scope for references in the schema. Current scope
+        of the resolver is used if not given.
+        """
+        if isinstance(schema, PlanNode):
+            return schema
+
+        if schema.is_undef():
+            return self.undef
+
+        if schema.val is self.root.val:
+            return self.root
+
+        try:
+            return self.nodes[id(schema.val)]
+        except KeyError:
+            pass
+
+        if len(self.nodes) >= self.MAX_NODES:
+            self.nodes.clear()
+
+        if scope is None:
+            scope = self.resolver.resolution_scope
+
+        node = PlanNode(self, schema, scope)
+        self.nodes[id(schema.val)] = node
+        return node
+
+    def compile(self):
+        """Build plan nodes for all parts of the schema that are reachable
+        through the keywords understood by the built-in strategies.
+
+        References to external schemas are not followed, since that might
+        require fetching them. They are resolved lazily during merge.
+        """
+        resolver = self.resolver
+
+        seen = set()
+        stack = [self.root]
+        while stack:
+            node = stack.pop()
+            if node.undef or id(node) in seen:
+                continue
+            seen.add(id(node))
+
+            if not self.merger.is_type(node.val, "object"):
+                continue
+
+            node.strategy()
+
+            ref = node.val.get("$ref")
+            if ref is not None and not resolver.is_remote_ref(ref):
+                stack.append(node.ref_target(resolver))
+
+            if "oneOf" in node.val:
+                stack.extend(node.children("oneOf"))
+                node.one_of_index()
+
+            properties, patterns, additional = node._object_keywords()
+            if not properties.undef:
+                for k in properties.val:
+                    stack.append(properties.child(k))
+            stack.extend(s for pattern, s in patterns)
+            stack.append(additional)
+
+            if self.merger.is_type(node.val.get("items"), "object"):
+                stack.append(node.child("items"))
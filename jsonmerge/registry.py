@@ -0,0 +1,130 @@
+# vim:ts=4 sw=4 expandtab softtabstop=4
+"""Local collections of JSON schemas for resolving external references.
+
+A SchemaRegistry indexes JSON schema files in a directory or a zip archive
+by their ids ('id' or '$id' keyword). When a registry is given to a Merger,
+external references are looked up in the registry instead of being fetched
+over the network.
+"""
+import io
+import json
+import os
+import sys
+import threading
+import zipfile
+
+if sys.version_info[0] >= 3:
+    from urllib.parse import urldefrag, urljoin, urlsplit
+else:
+    from urlparse import urldefrag, urljoin, urlsplit
+
+from jsonmerge.jsonvalue import text_type
+
+def _normalize(uri):
+    # Same normalization as used by the RefResolver store.
+    uri, fragment = urldefrag(uri)
+    return urlsplit(uri).geturl()
+
+class SchemaRegistry(object):
+    """Registry of JSON schemas in a directory or a zip archive.
+
+    path -- Path to a directory (searched recursively) or a zip archive.
+    base_uri -- Optional URI. If given, each file is also registered under
+    its path relative to path, joined with base_uri.
+    suffix -- Only files with names ending in suffix are registered.
+
+    IOError is raised if path is not a directory or a zip archive.
+
+    All files are read once when the registry is created to find their ids.
+    Documents are parsed again and kept in memory only when they are first
+    requested with get().
+    """
+
+    def __init__(self, path, base_uri=None, suffix='.json'):
+        self.path = path
+
+        if os.path.isdir(path):
+            self._zip = None
+        elif zipfile.is_zipfile(path):
+            self._zip = zipfile.ZipFile(path)
+        else:
+            raise IOError("'%s' is not a directory or a zip archive" % (path,))
+
+        self._lock = threading.Lock()
+        self._index = {}
+        self._documents = {}
+
+        for name in self._names(suffix):
+            if base_uri is not None:
+                self._index[_normalize(urljoin(base_uri, name))] = name
+
+            document = self._load(name)
+            if isinstance(document, dict):
+                uri = document.get('$id', document.get('id'))
+                if isinstance(uri, text_type):
+                    self._index[_normalize(uri)] = name
+
+    def _names(self, suffix):
+        # Return names of files, relative to path, with '/' as separator.
+        if self._zip is not None:
+            names = [ name for name in self._zip.namelist() if not name.endswith('/') ]
+        else:
+            names = []
+            for dirpath, dirnames, filenames in os.walk(self.path):
+                dirnames.sort()
+                rel = os.path.relpath(dirpath, self.path)
+                for filename in filenames:
+                    if rel == os.curdir:
+                        name = filename
+                    else:
+                        name = os.path.join(rel, filename).replace(os.sep, '/')
+                    names.append(name)
+
+        return sorted(name for name in names if name.endswith(suffix))
+
+    def _load(self, name):
+        if self._zip is not None:
+            with self._lock:
+                data = self._zip.read(name)
+            return json.loads(data.decode('utf-8'))
+        else:
+            with io.open(os.path.join(self.path, name), encoding='utf-8') as f:
+                return json.load(f)
+
+    def __contains__(self, uri):
+        return _normalize(uri) in self._index
+
+    def __len__(self):
+        return len(self._index)
+
+    def uris(self):
+        """Return a sorted list of URIs of registered schemas."""
+        return sorted(self._index)
+
+    def get(self, uri):
+        """Return the schema for uri.
+
+        Raises KeyError if there is no schema for uri in the registry.
+        """
+        uri = _normalize(uri)
+
+        name = self._index[uri]
+        try:
+            return self._documents[name]
+        except KeyError:
+            pass
+
+        document = self._load(name)
+
+        # Another thread might have loaded the document in the meantime.
+        return self._documents.setdefault(name, document)
+
+    def close(self):
+        if self._zip is not None:
+            self._zip.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
@@ -1,21 +1,80 @@
 # vim:ts=4 sw=4 expandtab softtabstop=4
 from jsonschema.validators import RefResolver, urldefrag, urljoin
+import jsonschema
 
 class LocalRefResolver(RefResolver):
     # We want to have a class that is the same as jsonschema's RefResolver
     # except:
     #
-    #  * No caching for resolves. We are changing the schema as we walk through
-    #    it, so with caching you can get outdated resolves.
+    #  * Resolved references are cached until invalidate() is called. Schemas
+    #    are not changed while merging or walking them, but the store of
+    #    schemas can change (e.g. with Merger.cache_schema()). Each call to
+    #    invalidate() increments the generation attribute. The Merger
+    #    compares it with the generation its merge plan and get_schema()
+    #    results were built for and rebuilds them when it has changed.
     #
     #  * Provide a _is_remote_ref() method to check if a $ref points to an
     #    external reference.
+    #
+    #  * If a SchemaRegistry is given in the registry argument, external
+    #    references are resolved from the registry and never fetched over the
+    #    network.
 
     def __init__(self, *args, **kwargs):
+        self.registry = kwargs.pop("registry", None)
+
         kwargs["remote_cache"] = self.resolve_from_url
         super(LocalRefResolver, self).__init__(*args, **kwargs)
 
+        self.generation = 0
+        self._resolved = {}
+        self._remote = {}
+
+    def invalidate(self):
+        """Forget resolved references.
+
+        Must be called after schemas in the store are added, replaced or
+        modified.
+        """
+        self.generation += 1
+        self._resolved.clear()
+        self._remote.clear()
+
+    def resolve(self, ref):
+        key = (self.resolution_scope, ref)
+        try:
+            return self._resolved[key]
+        except KeyError:
+            pass
+
+        rv = super(LocalRefResolver, self).resolve(ref)
+        self._resolved[key] = rv
+        return rv
+
     def is_remote_ref(self, ref):
+        key = (self.resolution_scope, ref)
+        try:
+            return self._remote[key]
+        except KeyError:
+            pass
+
         url = urljoin(self.resolution_scope, ref)
         url, fragment = urldefrag(url)
-        return url != self.base_uri
+        rv = url != self.base_uri
+
+        self._remote[key] = rv
+        return rv
+
+    def resolve_remote(self, uri):
+        if self.registry is None:
+            return super(LocalRefResolver, self).resolve_remote(uri)
+
+        try:
+            document = self.registry.get(uri)
+        except KeyError:
+            raise jsonschema.RefResolutionError("Schema '%s' not found in registry" % (uri,))
+
+        if self.cache_remote:
+            self.store[uri] = document
+
+        return document
@@ -2,14 +2,50 @@
 from jsonmerge.exceptions import HeadInstanceError, \
                                  BaseInstanceError, \
                                  SchemaError
-from jsonmerge.jsonvalue import JSONValue
+from jsonmerge.delta import diff
+from jsonmerge.descenders import Descend
+from jsonmerge.history import HistoryStore
+from jsonmerge.jsonvalue import JSONValue, UNDEF, path_of, compile_pointer, \
+                                canonical_hash
 import jsonschema
-import re
+
+_interfaces = {}
+
+def _interface(strategy, names):
+    # Return the name of the method out of names that is implemented by the
+    # most derived class of the strategy. Strategies that override merge()
+    # might depend on it being called, even if they inherit merge_steps()
+    # from a built-in strategy.
+    key = (type(strategy), names)
+    try:
+        return _interfaces[key]
+    except KeyError:
+        pass
+
+    for cls in type(strategy).__mro__:
+        for name in names:
+            if name in cls.__dict__:
+                _interfaces[key] = name
+                return name
+
+def _result_steps(func, *args, **kwargs):
+    # Steps generator that yields the result of func. Used for legacy
+    # methods that recurse with walk.descend() instead of yielding.
+    yield func(*args, **kwargs)
 
 class Strategy(object):
     """Base class for merge strategies.
     """
 
+    # Set to True in strategies that modify base directly when merging
+    # in-place (see Merger.merge()). Strategies can check whether they
+    # should do that with the inplace() method.
+    supports_inplace = False
+
+    def inplace(self, walk):
+        """Return True if base should be modified instead of copied."""
+        return self.supports_inplace and walk.inplace
+
     def merge(self, walk, base, head, schema, **kwargs):
         """Merge head instance into base.
 
@@ -20,15 +56,58 @@ class Strategy(object):
         kwargs -- Dict with any extra options given in the 'mergeOptions'
         keyword
 
-        Specific merge strategies should override this method to implement
-        their behavior.
+        Specific merge strategies should override this method, the
+        merge_raw() or the merge_steps() method to implement their behavior.
 
         The function should return the object resulting from the merge.
 
         Recursion into the next level, if necessary, is achieved by calling
         walk.descend() method.
         """
-        raise NotImplemented
+        path = path_of(base, head)
+
+        rv = self.merge_raw(walk, base.raw(), head.raw(), walk.plan.node(schema), path, **kwargs)
+        return path.value(rv)
+
+    def merge_raw(self, walk, base, head, schema, path, **kwargs):
+        """Merge head instance into base.
+
+        walk -- WalkInstance object for the current context.
+        base -- Raw value being merged into (UNDEF if undefined).
+        head -- Raw value being merged.
+        schema -- PlanNode for the schema used for merging.
+        path -- Path to base and head in the documents.
+        kwargs -- Dict with any extra options given in the 'mergeOptions'
+        keyword
+
+        This is an alternative to the merge() method that avoids wrapping
+        each value in a JSONValue object. Values are plain Python objects as
+        they appear in the documents. JSONValue objects, for example for
+        error reporting, can be obtained with path.value() for head and
+        path.base.value() for base.
+
+        The function should return the raw value resulting from the merge.
+
+        Recursion into the next level, if necessary, is achieved by calling
+        walk.descend_raw() method.
+        """
+        return walk.run(self.merge_steps(walk, base, head, schema, path, **kwargs))
+
+    def merge_steps(self, walk, base, head, schema, path, **kwargs):
+        """Merge head instance into base, without recursion.
+
+        Arguments are the same as for merge_raw(). The method must be a
+        generator. Instead of calling walk.descend_raw(), it yields a
+        Descend object with the subschema, base, head and path for the
+        next level. The merged value for the next level is sent back and
+        returned by the yield expression. The raw value resulting from the
+        merge is given in the last yield.
+
+        Strategies that recurse into the next level should implement this
+        method. That way, the depth of the merged documents is not limited
+        by the Python recursion limit.
+        """
+        raise NotImplementedError
 
     def get_schema(self, walk, schema, **kwargs):
         """Return the schema for the merged document.
@@ -47,26 +126,44 @@ class Strategy(object):
         Recursion into the next level, if necessary, is achieved by calling
         walk.descend() method.
         """
-        raise NotImplemented
+        return walk.run(self.get_schema_steps(walk, schema, **kwargs))
+
+    def get_schema_steps(self, walk, schema, **kwargs):
+        """Return the schema for the merged document, without recursion.
+
+        Arguments are the same as for get_schema(). Like merge_steps(), the
+        method must be a generator that yields Descend objects with
+        subschemas. The resulting schema is given in the last yield.
+        """
+        raise NotImplementedError
 
     def _resolve_ref(self, walk, item, ref):
-        if walk.is_type(JSONValue(ref), 'array'):
-            resolved = [ walk.resolver.resolve_fragment(item.val, i) for i in ref ]
+        # item is a raw value, or a JSONValue when called from methods
+        # written for older versions of jsonmerge.
+        if isinstance(item, JSONValue):
+            item = item.val
+
+        if walk.is_type_raw(ref, 'array'):
+            resolved = [ walk.resolver.resolve_fragment(item, i) for i in ref ]
         else:
-            resolved = walk.resolver.resolve_fragment(item.val, ref)
+            resolved = walk.resolver.resolve_fragment(item, ref)
 
         return resolved
 
 class Overwrite(Strategy):
-    def merge(self, walk, base, head, schema, **kwargs):
+    supports_inplace = True
+
+    def merge_raw(self, walk, base, head, schema, path, **kwargs):
         return head
 
     def get_schema(self, walk, schema, **kwargs):
         return schema
 
 class Discard(Strategy):
-    def merge(self, walk, base, head, schema, keepIfUndef=False, **kwargs):
-        if base.is_undef() and keepIfUndef:
+    supports_inplace = True
+
+    def merge_raw(self, walk, base, head, schema, path, keepIfUndef=False, **kwargs):
+        if base is UNDEF and keepIfUndef:
             return head
         else:
             return base
@@ -75,6 +172,7 @@ class Discard(Strategy):
         return schema
 
 class Version(Strategy):
+    supports_inplace = True
 
     def add_metadata(self, head, metadata):
         if metadata is None:
@@ -85,47 +183,123 @@ class Version(Strategy):
         rv['value'] = head
         return rv
 
-    def merge(self, walk, base, head, schema, limit=None, unique=None, ignoreDups=True, metadata=None, **kwargs):
+    def entry_hash(self, entry):
+        # Return None if the entry has neither a hash nor a value (e.g. an
+        # older version in versionDelta without a stored hash).
+        h = entry.get('valueHash')
+        if h is None and 'value' in entry:
+            h = canonical_hash(entry['value'])
+
+        return h
+
+    def is_duplicate(self, base, head, dupsWindow, head_hash):
+        """Return True if head is the same as a value in the last dupsWindow
+        entries in base (all entries if dupsWindow is None). If head_hash is
+        not None, values are compared by their hashes. Stored hashes are
+        used where available, so each entry costs O(1) instead of a deep
+        comparison, but computing head_hash serializes all of head."""
+        if dupsWindow is not None:
+            base = base[-dupsWindow:]
+
+        for entry in base:
+            if not isinstance(entry, dict):
+                continue
+
+            if head_hash is not None:
+                if self.entry_hash(entry) == head_hash:
+                    return True
+            elif 'value' in entry:
+                if entry['value'] == head:
+                    return True
+
+        return False
+
+    def merge_raw(self, walk, base, head, schema, path, limit=None, unique=None, ignoreDups=True, metadata=None,
+            hashValues=False, dupsWindow=1, historyStore=None, historyKey=None, **kwargs):
 
         # backwards compatibility
         if unique is False:
             ignoreDups = False
 
         if metadata is not None:
-            if not walk.is_type(JSONValue(val=metadata), "object"):
+            if not walk.is_type_raw(metadata, "object"):
                 raise SchemaError("'metadata' option does not contain an object")
 
-        if base.is_undef():
-            base = JSONValue(val=[], ref=base.ref)
-            last_entry = JSONValue(undef=True)
+        if dupsWindow is not None:
+            if not walk.is_type_raw(dupsWindow, "integer") or dupsWindow < 1:
+                raise SchemaError("'dupsWindow' option is not a positive integer", schema)
+
+        if historyStore is not None:
+            if not isinstance(historyStore, HistoryStore):
+                raise SchemaError("'historyStore' option does not contain a HistoryStore", schema)
+
+            # By default, only the last version is kept in the document.
+            if limit is None:
+                limit = 1
+
+        if base is UNDEF:
+            base = []
+            last_entry = UNDEF
         else:
-            if not walk.is_type(base, "array"):
+            if not walk.is_type_raw(base, "array"):
                 raise BaseInstanceError("Base is not an array. "
-                        "Base not previously generated with this strategy?", base)
-
-            base = JSONValue(list(base.val), base.ref)
+                        "Base not previously generated with this strategy?", path.base.value(base))
 
-            if base.val:
+            if base:
                 last_entry = base[-1]
 
-                if not walk.is_type(last_entry, "object"):
+                if not walk.is_type_raw(last_entry, "object"):
                     raise BaseInstanceError("Last entry in the versioned array is not an object. "
-                            "Base not previously generated with this strategy?", last_entry)
+                            "Base not previously generated with this strategy?",
+                            path.base.child(len(base) - 1).value(last_entry))
 
-                if 'value' not in last_entry.val:
+                if 'value' not in last_entry:
                     raise BaseInstanceError("Last entry in the versioned array has no 'value' property. "
-                            "Base not previously generated with this strategy?", last_entry)
+                            "Base not previously generated with this strategy?",
+                            path.base.child(len(base) - 1).value(last_entry))
             else:
-                last_entry = JSONValue(undef=True)
+                last_entry = UNDEF
+
+        if hashValues:
+            head_hash = canonical_hash(head)
+        else:
+            head_hash = None
+
+        if not ignoreDups or last_entry is UNDEF or \
+                not self.is_duplicate(base, head, dupsWindow, head_hash):
+            entry = self.add_metadata(head, metadata)
+            if head_hash is not None:
+                entry['valueHash'] = head_hash
+
+            if historyStore is not None:
+                historyStore.append(historyKey, path.ref, entry)
 
-        if not ignoreDups or last_entry.is_undef() or last_entry['value'].val != head.val:
-            base.val.append(self.add_metadata(head.val, metadata))
-            if limit is not None:
-                base.val = base.val[-limit:]
+            base = self.append_version(walk, base, entry, limit)
 
         return base
 
-    def get_schema(self, walk, schema, limit=None, metadataSchema=None, **kwargs):
+    def append_version(self, walk, base, entry, limit):
+        # base is copied only if a new version is added. With limit, only
+        # the versions that are kept are copied, so a merge costs O(limit)
+        # instead of O(len(base)). Merging in-place avoids the copy, but
+        # once the history is full, removing the oldest versions still
+        # moves the remaining limit - 1 entries. The array can't hold more
+        # than limit versions between merges, so trimming can't be batched.
+        if limit is not None and len(base) >= limit:
+            if self.inplace(walk):
+                del base[:len(base) - limit + 1]
+            else:
+                base = base[len(base) - limit + 1:]
+        elif not self.inplace(walk):
+            base = list(base)
+
+        base.append(entry)
+        return base
+
+    def get_schema(self, walk, schema, limit=None, metadataSchema=None, hashValues=False, historyStore=None, **kwargs):
+
+        if historyStore is not None and limit is None:
+            limit = 1
 
         if metadataSchema is not None:
             item = dict(walk.resolve_subschema_option_refs(metadataSchema))
@@ -139,6 +313,9 @@ class Version(Strategy):
 
         item['properties']['value'] = schema.val
 
+        if hashValues:
+            item['properties']['valueHash'] = {'type': 'string'}
+
         rv = {  "type": "array",
                 "items": item }
 
@@ -147,20 +324,58 @@ class Version(Strategy):
 
         return JSONValue(rv, schema.ref)
 
+class VersionDelta(Version):
+    """Version strategy that keeps older versions as deltas.
+
+    The last version is kept in full in the 'value' property. When a new
+    version is appended, the value of the previous one is replaced with a
+    'delta' property (see jsonmerge.delta). Use jsonmerge.delta.reconstruct()
+    to get all values back.
+    """
+
+    def append_version(self, walk, base, entry, limit):
+        base = super(VersionDelta, self).append_version(walk, base, entry, limit)
+
+        if len(base) > 1:
+            prev = dict(base[-2])
+            prev['delta'] = diff(prev.pop('value'), entry['value'])
+            base[-2] = prev
+
+        return base
+
+    def get_schema(self, walk, schema, **kwargs):
+        rv = super(VersionDelta, self).get_schema(walk, schema, **kwargs)
+
+        rv.val['items']['properties']['delta'] = {'type': 'object'}
+
+        return rv
+
 class ArrayStrategy(Strategy):
-    def merge(self, walk, base, head, schema, **kwargs):
-        if not walk.is_type(head, "array"):
-            raise HeadInstanceError("Head is not an array", head)
+    supports_inplace = True
+
+    def merge_raw(self, walk, base, head, schema, path, **kwargs):
+        base = self._prepare_raw(walk, base, head, path)
+        return self._merge_raw(walk, base, head, schema, path, **kwargs)
 
-        if base.is_undef():
-            base = JSONValue([], base.ref)
+    def _prepare_raw(self, walk, base, head, path):
+        if not walk.is_type_raw(head, "array"):
+            raise HeadInstanceError("Head is not an array", path.value(head))
+
+        if base is UNDEF:
+            base = []
         else:
-            if not walk.is_type(base, "array"):
-                raise BaseInstanceError("Base is not an array", base)
+            if not walk.is_type_raw(base, "array"):
+                raise BaseInstanceError("Base is not an array", path.base.value(base))
+
+            if not self.inplace(walk):
+                base = list(base)
 
-            base = JSONValue(list(base.val), base.ref)
+        return base
 
-        return self._merge(walk, base, head, schema, **kwargs)
+    def _merge_raw(self, walk, base, head, schema, path, **kwargs):
+        # Subclasses written for older versions of jsonmerge implement
+        # _merge(), which works with JSONValue objects.
+        return self._merge(walk, path.base.value(base), path.value(head), schema, **kwargs).raw()
 
     def default_key(self):
         # This object always sorts after other items
@@ -177,21 +392,44 @@ class ArrayStrategy(Strategy):
         return UnknownKey()
 
     def sort_array(self, walk, base, sortByRef, sortReverse):
-        assert walk.is_type(base, "array")
+        # base is a raw array, or a JSONValue when called from _merge().
+        if isinstance(base, JSONValue):
+            base = base.val
+
+        assert walk.is_type_raw(base, "array")
 
         if sortByRef is None:
             return
 
+        get = compile_pointer(sortByRef)
+        default_key = self.default_key()
+
         def key(item):
-            try:
-                return self._resolve_ref(walk, item, sortByRef)
-            except jsonschema.RefResolutionError:
-                return self.default_key()
+            k = get(item)
+            if k is UNDEF:
+                return default_key
+            else:
+                return k
 
+        # Keys are computed once per item. An array that was sorted by a
+        # previous merge is a single run for the sort, so sorting it again
+        # with a few new items takes linear time.
         base.sort(key=key, reverse=bool(sortReverse))
 
 class Append(ArrayStrategy):
+    def _merge_raw(self, walk, base, head, schema, path, sortByRef=None, sortReverse=None, **kwargs):
+        if type(self)._merge != Append._merge:
+            return super(Append, self)._merge_raw(walk, base, head, schema, path,
+                    sortByRef=sortByRef, sortReverse=sortReverse, **kwargs)
+
+        base += head
+
+        self.sort_array(walk, base, sortByRef, sortReverse)
+
+        return base
+
     def _merge(self, walk, base, head, schema, sortByRef=None, sortReverse=None, **kwargs):
+        # JSONValue interface, kept for subclasses that override _merge().
         base.val += head.val
 
         self.sort_array(walk, base, sortByRef, sortReverse)
@@ -204,10 +442,81 @@ class Append(ArrayStrategy):
 
         return schema
 
+def _unique_key(item):
+    # Hashable key for an array item. Objects and arrays are hashed by their
+    # canonical JSON serialization. As with canonical_hash(), values of
+    # different JSON types (e.g. 1 and 1.0, or 1 and true) have different
+    # keys.
+    if isinstance(item, (dict, list)):
+        return (0, canonical_hash(item))
+    elif isinstance(item, bool):
+        return (1, item)
+    elif isinstance(item, float):
+        return (2, item)
+    else:
+        return (3, item)
+
+class AppendUnique(Append):
+    """Append strategy that only appends items that are not yet in the
+    array.
+
+    Items in base are kept as they are.
+    """
+
+    def _merge_raw(self, walk, base, head, schema, path, **kwargs):
+        keys = set(_unique_key(item) for item in base)
+
+        new = []
+        for item in head:
+            k = _unique_key(item)
+            if k not in keys:
+                keys.add(k)
+                new.append(item)
+
+        return super(AppendUnique, self)._merge_raw(walk, base, new, schema, path, **kwargs)
+
+class _KeyIndex(object):
+    # Maps item keys to lists of indexes of items with that key. Composite
+    # keys (lists) are stored as tuples. Keys that still can't be hashed
+    # (e.g. objects) are compared with each item in turn.
+
+    def __init__(self):
+        self.hashed = {}
+        self.unhashed = []
+
+    def add(self, key, i):
+        if isinstance(key, list):
+            hkey = tuple(key)
+        else:
+            hkey = key
+
+        try:
+            l = self.hashed.get(hkey)
+        except TypeError:
+            self.unhashed.append((key, i))
+            return
+
+        if l is None:
+            self.hashed[hkey] = [i]
+        else:
+            l.append(i)
+
+    def find(self, key):
+        """Return a list of indexes of items with the given key."""
+        if isinstance(key, list):
+            hkey = tuple(key)
+        else:
+            hkey = key
+
+        try:
+            return self.hashed.get(hkey, ())
+        except TypeError:
+            return [ i for k, i in self.unhashed if k == key ]
+
 class ArrayMergeById(ArrayStrategy):
 
     def get_key(self, walk, item, idRef):
-        return self._resolve_ref(walk, item, idRef)
+        return self._resolve_ref(walk, item.val, idRef)
 
     def iter_index_key_item(self, walk, jv, idRef):
         for i, item in enumerate(jv):
@@ -218,53 +527,91 @@ class ArrayMergeById(ArrayStrategy):
 
             yield i, key, item
 
-    def _merge(self, walk, base, head, schema, idRef="id", ignoreId=None, sortByRef=None, sortReverse=None, **kwargs):
-        subschema = schema.get('items')
+    def iter_index_key_raw(self, walk, items, path, idRef):
+        # Same as iter_index_key_item(), but for a raw array. Unless a
+        # subclass customizes how keys are obtained, keys are looked up with
+        # a compiled pointer instead of going through the RefResolver.
+        cls = type(self)
+        if cls.get_key != ArrayMergeById.get_key or \
+                cls.iter_index_key_item != ArrayMergeById.iter_index_key_item:
+            for i, key, item in self.iter_index_key_item(walk, path.value(items), idRef):
+                yield i, key, item.val
+        else:
+            get = compile_pointer(idRef)
+            for i, item in enumerate(items):
+                key = get(item)
+                if key is not UNDEF:
+                    yield i, key, item
+
+    def merge_steps(self, walk, base, head, schema, path, **kwargs):
+        if type(self)._merge != ArrayMergeById._merge:
+            return _result_steps(self.merge_raw, walk, base, head, schema, path, **kwargs)
+        else:
+            return self._merge_steps(walk, base, head, schema, path, **kwargs)
+
+    def _merge_steps(self, walk, base, head, schema, path, idRef="id", ignoreId=None, sortByRef=None, sortReverse=None, **kwargs):
+        base = self._prepare_raw(walk, base, head, path)
+
+        subschema = schema.child('items')
 
         if walk.is_type(subschema, "array"):
             raise SchemaError("This strategy is not supported when 'items' is an array", subschema)
 
-        for i, key_1, item_1 in self.iter_index_key_item(walk, head, idRef):
-            for j, key_2, item_2 in self.iter_index_key_item(walk, head, idRef):
-                if j < i:
-                    if key_1 == key_2:
-                        raise HeadInstanceError("Id '%s' was not unique in head" % (key_1,), item_1)
-                else:
-                    break
+        head_items = list(self.iter_index_key_raw(walk, head, path, idRef))
 
-        for i, head_key, head_item in self.iter_index_key_item(walk, head, idRef):
+        seen = _KeyIndex()
+        for i, head_key, head_item in head_items:
+            if seen.find(head_key):
+                raise HeadInstanceError("Id '%s' was not unique in head" % (head_key,),
+                        path.child(i).value(head_item))
+            seen.add(head_key, i)
+
+        index = _KeyIndex()
+        for j, base_key, base_item in self.iter_index_key_raw(walk, base, path.base, idRef):
+            index.add(base_key, j)
+
+        # Items appended below are not added to the index. Keys in head are
+        # unique, so later head items can't match them.
+        for i, head_key, head_item in head_items:
 
             if head_key == ignoreId:
                 continue
 
-            matching_j = []
-            for j, base_key, base_item in self.iter_index_key_item(walk, base, idRef):
-
-                if base_key == head_key:
-                    matching_j.append(j)
-                    matched_item = base_item
+            matching_j = index.find(head_key)
 
             if len(matching_j) == 1:
                 # If there was exactly one match, we replace it with a merged item
                 j = matching_j[0]
-                base[j] = walk.descend(subschema, matched_item, head_item)
+                rv = yield Descend(subschema, base[j], head_item, path.child(i, j))
+                if rv is UNDEF:
+                    raise ValueError("Can't assign an undefined value to a list")
+                base[j] = rv
             elif len(matching_j) == 0:
                 # If there wasn't a match, we append a new object
-                base.append(walk.descend(subschema, JSONValue(undef=True), head_item))
+                rv = yield Descend(subschema, UNDEF, head_item, path.child(i, len(base)))
+                if rv is not UNDEF:
+                    base.append(rv)
             else:
                 j = matching_j[1]
-                raise BaseInstanceError("Id '%s' was not unique in base" % (base_key,), base[j])
+                raise BaseInstanceError("Id '%s' was not unique in base" % (head_key,),
+                        path.base.child(j).value(base[j]))
 
         self.sort_array(walk, base, sortByRef, sortReverse)
 
-        return base
+        yield base
 
-    def get_schema(self, walk, schema, **kwargs):
+    def _merge(self, walk, base, head, schema, **kwargs):
+        # JSONValue interface, kept for subclasses that override _merge().
+        path = path_of(base, head)
+        rv = walk.run(self._merge_steps(walk, base.val, head.val, walk.plan.node(schema), path, **kwargs))
+        return path.value(rv)
+
+    def get_schema_steps(self, walk, schema, **kwargs):
         subschema = schema.get('items')
         if not subschema.is_undef():
-            schema['items'] = walk.descend(subschema)
+            schema['items'] = yield Descend(subschema)
 
-        return schema
+        yield schema
 
 
 class ArrayMergeByIndex(ArrayMergeById):
@@ -273,6 +620,45 @@ class ArrayMergeByIndex(ArrayMergeById):
         for i, item in enumerate(jv):
             yield i, i, item
 
+    def merge_steps(self, walk, base, head, schema, path, **kwargs):
+        # Subclasses that customize keys or override _merge() get the
+        # generic implementation from ArrayMergeById.
+        cls = type(self)
+        if cls.iter_index_key_item != ArrayMergeByIndex.iter_index_key_item or \
+                cls._merge != ArrayMergeById._merge:
+            return super(ArrayMergeByIndex, self).merge_steps(walk, base, head, schema, path, **kwargs)
+        else:
+            return self._merge_by_index_steps(walk, base, head, schema, path, **kwargs)
+
+    def _merge_by_index_steps(self, walk, base, head, schema, path, ignoreId=None, sortByRef=None, sortReverse=None, **kwargs):
+        base = self._prepare_raw(walk, base, head, path)
+
+        subschema = schema.child('items')
+
+        if walk.is_type(subschema, "array"):
+            raise SchemaError("This strategy is not supported when 'items' is an array", subschema)
+
+        n = len(base)
+
+        for i, head_item in enumerate(head):
+
+            if i == ignoreId:
+                continue
+
+            if i < n:
+                rv = yield Descend(subschema, base[i], head_item, path.child(i))
+                if rv is UNDEF:
+                    raise ValueError("Can't assign an undefined value to a list")
+                base[i] = rv
+            else:
+                rv = yield Descend(subschema, UNDEF, head_item, path.child(i, len(base)))
+                if rv is not UNDEF:
+                    base.append(rv)
+
+        self.sort_array(walk, base, sortByRef, sortReverse)
+
+        yield base
+
 
 class ObjectMerge(Strategy):
     """A Strategy for merging objects.
@@ -284,9 +670,10 @@ class ObjectMerge(Strategy):
     keywords). 
 
     walk -- WalkInstance object for the current context.
-    base -- JSONValue being merged into.
-    head -- JSONValue being merged.
-    schema -- Schema used for merging (also JSONValue)
+    base -- Raw value being merged into.
+    head -- Raw value being merged.
+    schema -- PlanNode for the schema used for merging.
+    path -- Path to base and head in the documents.
     objclass_menu -- A dictionary of classes to use as a JSON object.
     kwargs -- Any extra options given in the 'mergeOptions' keyword.
 
@@ -299,10 +686,15 @@ class ObjectMerge(Strategy):
     One mergeOption is supported:
 
     objClass -- a name for the class to use as a JSON object in the output.
+
+    When merging in-place, objClass only applies to objects that are not
+    already present in base.
     """
-    def merge(self, walk, base, head, schema, objclass_menu=None, objClass='_default', **kwargs):
-        if not walk.is_type(head, "object"):
-            raise HeadInstanceError("Head is not an object", head)
+    supports_inplace = True
+
+    def merge_steps(self, walk, base, head, schema, path, objclass_menu=None, objClass='_default', **kwargs):
+        if not walk.is_type_raw(head, "object"):
+            raise HeadInstanceError("Head is not an object", path.value(head))
 
         if objclass_menu is None:
             objclass_menu = { '_default': dict }
@@ -311,56 +703,47 @@ class ObjectMerge(Strategy):
         if objcls is None:
             raise SchemaError("objClass '%s' not recognized" % objClass, schema)
 
-        if base.is_undef():
-            base = JSONValue(objcls(), base.ref)
+        if base is UNDEF:
+            base = objcls()
         else:
-            if not walk.is_type(base, "object"):
-                raise BaseInstanceError("Base is not an object", base)
+            if not walk.is_type_raw(base, "object"):
+                raise BaseInstanceError("Base is not an object", path.base.value(base))
 
-            base = JSONValue(objcls(base.val), base.ref)
+            if not self.inplace(walk):
+                base = objcls(base)
 
         for k, v in head.items():
+            subschema = schema.property_schema(k)
 
-            subschema = JSONValue(undef=True)
-
-            # get subschema for this element
-            if not schema.is_undef():
-                p = schema.get('properties')
-                if not p.is_undef():
-                    subschema = p.get(k)
+            # null in base is treated as an undefined value
+            b = base.get(k)
+            if b is None:
+                b = UNDEF
 
-                if subschema.is_undef():
-                    p = schema.get('patternProperties')
-                    if not p.is_undef():
-                        for pattern, s in p.items():
-                            if re.search(pattern, k):
-                                subschema = s
+            rv = yield Descend(subschema, b, v, path.child(k))
 
-                if subschema.is_undef():
-                    p = schema.get('additionalProperties')
-                    # additionalProperties can be boolean in draft 4
-                    if not p.is_undef() and walk.is_type(p, "object"):
-                        subschema = p
+            # setting an element to an undefined value deletes that element
+            if rv is UNDEF:
+                if k in base:
+                    del base[k]
+            else:
+                base[k] = rv
 
-            base[k] = walk.descend(subschema, base.get(k), v)
+        yield base
 
-        return base
-
-    def get_schema(self, walk, schema, **kwargs):
+    def get_schema_steps(self, walk, schema, **kwargs):
         schema2 = JSONValue(dict(schema.val), schema.ref)
 
-        def descend_keyword(keyword):
+        for keyword in ("properties", "patternProperties"):
             p = schema.get(keyword)
             if not p.is_undef():
+                schema2.val[keyword] = dict(p.val)
                 for k, v in p.items():
-                    schema2[keyword][k] = walk.descend(v)
-
-        descend_keyword("properties")
-        descend_keyword("patternProperties")
+                    schema2[keyword][k] = yield Descend(v)
 
        # additionalProperties can be boolean in draft 4
         p = schema.get("additionalProperties")
         if not p.is_undef() and walk.is_type(p, "object"):
-            schema2["additionalProperties"] = walk.descend(p)
+            schema2["additionalProperties"] = yield Descend(p)
 
-        return schema2
+        yield schema2
@@ -0,0 +1,207 @@
+# vim:ts=4 sw=4 expandtab softtabstop=4
+import copy
+import unittest
+
+import jsonmerge
+from jsonmerge.bundle import bundle
+
+A = {
+    'id': 'http://example.com/a.json',
+    'definitions': {
+        'version': {'mergeStrategy': 'version'},
+        'list': {
+            'mergeStrategy': 'append',
+            'items': {'$ref': 'b.json'}
+        }
+    }
+}
+
+B = {
+    'id': 'http://example.com/b.json',
+    'properties': {
+        'next': {'$ref': '#'},
+        'v': {'$ref': 'a.json#/definitions/version'}
+    }
+}
+
+def refs(value):
+    rv = []
+    stack = [value]
+    while stack:
+        v = stack.pop()
+        if isinstance(v, dict):
+            if isinstance(v.get('$ref'), str):
+                rv.append(v['$ref'])
+            stack.extend(v.values())
+        elif isinstance(v, list):
+            stack.extend(v)
+
+    return sorted(rv)
+
+class TestBundle(unittest.TestCase):
+
+    def test_local(self):
+        schema = {
+            'properties': {
+                'a': {'$ref': '#/definitions/a'}
+            },
+            'definitions': {
+                'a': {'mergeStrategy': 'version'}
+            }
+        }
+
+        self.assertEqual(bundle(schema), schema)
+
+    def test_remote(self):
+        schema = {
+            'properties': {
+                'a': {'$ref': 'http://example.com/a.json#/definitions/version'}
+            }
+        }
+
+        rv = bundle(schema, schemas=[A, B])
+
+        self.assertEqual(rv, {
+            'properties': {
+                'a': {'$ref': '#/definitions/a.json_definitions_version'}
+            },
+            'definitions': {
+                'a.json_definitions_version': {'mergeStrategy': 'version'}
+            }
+        })
+
+    def test_does_not_modify_schema(self):
+        schema = {
+            'properties': {
+                'a': {'$ref': 'http://example.com/a.json#/definitions/version'}
+            },
+            'definitions': {
+                'b': {'type': 'string'}
+            }
+        }
+
+        orig = copy.deepcopy(schema)
+        rv = bundle(schema, schemas=[A])
+
+        self.assertEqual(schema, orig)
+        self.assertEqual(sorted(rv['definitions']), ['a.json_definitions_version', 'b'])
+
+    def test_cycle(self):
+        schema = {
+            'properties': {
+                'a': {'$ref': 'http://example.com/a.json#/definitions/list'}
+            }
+        }
+
+        rv = bundle(schema, schemas=[A, B])
+
+        self.assertEqual(refs(rv), [
+            '#/definitions/a.json_definitions_list',
+            '#/definitions/a.json_definitions_version',
+            '#/definitions/b.json',
+            '#/definitions/b.json',
+        ])
+
+        self.assertEqual(rv['definitions']['b.json'], {
+            'properties': {
+                'next': {'$ref': '#/definitions/b.json'},
+                'v': {'$ref': '#/definitions/a.json_definitions_version'}
+            }
+        })
+
+        # Merging with the bundled schema doesn't need external schemas.
+        head = {'a': [{'v': 1, 'next': {'v': 2}}]}
+
+        merger = jsonmerge.Merger(schema)
+        merger.cache_schema(A)
+        merger.cache_schema(B)
+
+        self.assertEqual(jsonmerge.Merger(rv).merge(None, head), merger.merge(None, head))
+
+    def test_name_conflict(self):
+        schema = {
+            'properties': {
+                'a': {'$ref': 'http://example.com/b.json'},
+                'b': {'$ref': 'http://example.com/other/b.json'}
+            },
+            'definitions': {
+                'b.json': {}
+            }
+        }
+
+        other = {'id': 'http://example.com/other/b.json'}
+
+        rv = bundle(schema, schemas=[B, A, other])
+
+        self.assertEqual(rv['definitions']['b.json'], {})
+        self.assertEqual(sorted(rv['definitions']),
+                ['a.json_definitions_version', 'b.json', 'b.json_2', 'b.json_3'])
+
+    def test_nested_id(self):
+        schema = {
+            'id': 'http://example.com/root.json',
+            'properties': {
+                'a': {
+                    'id': 'http://example.com/a.json',
+                    'properties': {
+                        'b': {'$ref': '#/definitions/version'}
+                    }
+                },
+                'c': {'$ref': '#/properties/a'}
+            },
+        }
+
+        rv = bundle(schema, schemas=[A])
+
+        self.assertEqual(rv, {
+            'id': 'http://example.com/root.json',
+            'properties': {
+                'a': {
+                    'properties': {
+                        'b': {'$ref': '#/definitions/a.json_definitions_version'}
+                    }
+                },
+                'c': {'$ref': '#/properties/a'}
+            },
+            'definitions': {
+                'a.json_definitions_version': {'mergeStrategy': 'version'}
+            }
+        })
+
+    def test_keywords(self):
+        schema = {
+            'mergeStrategy': 'version',
+            'mergeOptions': {
+                'metadataSchema': {'$ref': 'http://example.com/b.json'},
+                'metadata': {'$ref': 'http://example.com/c.json'}
+            },
+            'default': {'$ref': 'http://example.com/c.json'},
+            'properties': {
+                'default': {'$ref': 'http://example.com/a.json#/definitions/version'},
+                'id': {'type': 'string'},
+            }
+        }
+
+        rv = bundle(schema, schemas=[A, B])
+
+        self.assertEqual(rv['mergeOptions'], {
+            'metadataSchema': {'$ref': '#/definitions/b.json'},
+            'metadata': {'$ref': 'http://example.com/c.json'}
+        })
+        self.assertEqual(rv['default'], {'$ref': 'http://example.com/c.json'})
+        self.assertEqual(rv['properties'], {
+            'default': {'$ref': '#/definitions/a.json_definitions_version'},
+            'id': {'type': 'string'},
+        })
+
+    def test_keyword(self):
+        schema = {'$ref': 'http://example.com/a.json#/definitions/version'}
+
+        rv = bundle(schema, schemas=[A], keyword='$defs')
+
+        self.assertEqual(rv, {
+            '$ref': '#/$defs/a.json_definitions_version',
+            '$defs': {
+                'a.json_definitions_version': {'mergeStrategy': 'version'}
+            }
+        })
@@ -0,0 +1,83 @@
+# vim:ts=4 sw=4 expandtab softtabstop=4
+import unittest
+
+from jsonmerge.delta import diff, patch, reconstruct
+
+class TestDelta(unittest.TestCase):
+
+    def check(self, old, new):
+        delta = diff(old, new)
+        rv = patch(new, delta)
+
+        self.assertEqual(rv, old)
+        self.assertEqual(type(rv), type(old))
+
+        return delta
+
+    def test_same(self):
+        self.assertEqual(self.check({'a': [1, {'b': None}]}, {'a': [1, {'b': None}]}), {})
+
+    def test_scalar(self):
+        self.assertEqual(self.check(1, "a"), {'replace': 1})
+
+    def test_type(self):
+        self.assertEqual(self.check(1, 1.0), {'replace': 1})
+        self.assertEqual(self.check(1, True), {'replace': 1})
+
+    def test_object(self):
+        delta = self.check({'a': 1, 'b': 2, 'c': None}, {'b': 3, 'c': None, 'd': 4})
+
+        self.assertEqual(delta, {'object': {'a': {'replace': 1},
+                                            'b': {'replace': 2}},
+                                 'remove': ['d']})
+
+    def test_array(self):
+        self.assertEqual(self.check([1, 2, 3], [1, 4]),
+                {'items': {'1': {'replace': 2}}, 'extend': [3]})
+        self.assertEqual(self.check([1, 2], [1, 2, 3]),
+                {'truncate': 2})
+
+    def test_nested(self):
+        old = {'a': [{'b': 1, 'c': 2}, {'d': 3}]}
+        new = {'a': [{'b': 1, 'c': 4}, {'d': 3}]}
+
+        self.assertEqual(self.check(old, new),
+                {'object': {'a': {'items': {'0': {'object': {'c': {'replace': 2}}}}}}})
+
+    def test_patch_does_not_modify(self):
+        new = {'a': {'b': [1]}}
+        patch(new, diff({'a': {'b': [2]}}, new))
+
+        self.assertEqual(new, {'a': {'b': [1]}})
+
+    def test_deep(self):
+        old = 1
+        new = 2
+        for i in range(10000):
+            old = {'a': [old]}
+            new = {'a': [new]}
+
+        rv = patch(new, diff(old, new))
+        for i in range(10000):
+            rv = rv['a'][0]
+
+        self.assertEqual(rv, 1)
+
+class TestReconstruct(unittest.TestCase):
+
+    def test_reconstruct(self):
+        versions = [{'delta': {'replace': 1}, 'v': 1},
+                    {'value': 2, 'v': 2},
+                    {'delta': {'replace': 3}},
+                    {'value': 4}]
+
+        self.assertEqual(reconstruct(versions),
+                [{'value': 1, 'v': 1}, {'value': 2, 'v': 2}, {'value': 3}, {'value': 4}])
+        self.assertEqual(versions[0], {'delta': {'replace': 1}, 'v': 1})
+
+    def test_empty(self):
+        self.assertEqual(reconstruct([]), [])
+
+    def test_no_value(self):
+        with self.assertRaises(ValueError):
+            reconstruct([{'delta': {'replace': 1}}])
@@ -0,0 +1,89 @@
+# vim:ts=4 sw=4 expandtab softtabstop=4
+import os
+import shutil
+import tempfile
+import unittest
+
+from jsonmerge.history import HistoryStore, FileHistoryStore, SQLiteHistoryStore
+
+class HistoryStoreTests(object):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.path = os.path.join(self.dir, 'history')
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def test_empty(self):
+        with self.open() as store:
+            self.assertEqual(list(store.read('a', '#')), [])
+            self.assertEqual(store.count('a', '#'), 0)
+
+    def test_append(self):
+        with self.open() as store:
+            store.append('a', '#/x', {'value': 1})
+            store.append('b', '#/x', {'value': 2})
+            store.append('a', '#/y', {'value': 3})
+            store.append('a', '#/x', {'value': u'\u20ac'})
+
+            self.assertEqual(list(store.read('a', '#/x')), [{'value': 1}, {'value': u'\u20ac'}])
+            self.assertEqual(list(store.read('b', '#/x')), [{'value': 2}])
+            self.assertEqual(store.count('a', '#/x'), 2)
+
+    def test_no_key(self):
+        with self.open() as store:
+            store.append(None, '#', {'value': 1})
+            store.append('a', '#', {'value': 2})
+
+            self.assertEqual(list(store.read(None, '#')), [{'value': 1}])
+
+    def test_reopen(self):
+        with self.open() as store:
+            store.append('a', '#', {'value': 1})
+
+        with self.open() as store:
+            store.append('a', '#', {'value': 2})
+            self.assertEqual(list(store.read('a', '#')), [{'value': 1}, {'value': 2}])
+
+    def test_read_lazy(self):
+        with self.open() as store:
+            for i in range(10):
+                store.append('a', '#', {'value': i})
+
+            it = store.read('a', '#')
+            self.assertEqual(next(it), {'value': 0})
+            self.assertEqual(next(it), {'value': 1})
+
+class TestFileHistoryStore(HistoryStoreTests, unittest.TestCase):
+
+    def open(self):
+        return FileHistoryStore(self.path)
+
+class TestSQLiteHistoryStore(HistoryStoreTests, unittest.TestCase):
+
+    def open(self):
+        return SQLiteHistoryStore(self.path)
+
+    def test_no_autocommit(self):
+        store = SQLiteHistoryStore(self.path, autocommit=False)
+        store.append('a', '#', {'value': 1})
+
+        other = SQLiteHistoryStore(self.path)
+        self.assertEqual(other.count('a', '#'), 0)
+
+        store.commit()
+        self.assertEqual(other.count('a', '#'), 1)
+
+        other.close()
+        store.close()
+
+class TestHistoryStore(unittest.TestCase):
+
+    def test_count(self):
+
+        class MyStore(HistoryStore):
+            def read(self, key, ref):
+                return iter([{'value': 1}, {'value': 2}])
+
+        self.assertEqual(MyStore().count('a', '#'), 2)
@@ -1,17 +1,22 @@
 # vim:ts=4 sw=4 expandtab softtabstop=4
+import copy
 import unittest
 import warnings
 import sys
+import threading
 
 from collections import OrderedDict
 import jsonmerge
 import jsonmerge.strategies
+import jsonmerge.history
+import jsonmerge.delta
 from jsonmerge.exceptions import (
     HeadInstanceError,
     BaseInstanceError,
     SchemaError
 )
 from jsonmerge.jsonvalue import JSONValue
+from jsonmerge.descenders import Descend
 
 import jsonschema
 
@@ -113,6 +118,76 @@ class TestMerge(unittest.TestCase):
 
         self.assertEqual(base, [{'value': "a"}, {'value': "a"}])
 
+    def test_version_dups_window(self):
+        schema = {'mergeStrategy': 'version',
+                  'mergeOptions': {'dupsWindow': 2}}
+
+        merger = jsonmerge.Merger(schema)
+
+        base = None
+        for head in ("a", "b", "a", "c", "a", "a"):
+            base = merger.merge(base, head)
+
+        self.assertEqual(base, [{'value': "a"}, {'value': "b"}, {'value': "c"}, {'value': "a"}])
+
+    def test_version_dups_window_all(self):
+        schema = {'mergeStrategy': 'version',
+                  'mergeOptions': {'dupsWindow': None}}
+
+        merger = jsonmerge.Merger(schema)
+
+        base = None
+        for head in ("a", "b", "c", "a", "b"):
+            base = merger.merge(base, head)
+
+        self.assertEqual(base, [{'value': "a"}, {'value': "b"}, {'value': "c"}])
+
+    def test_version_dups_window_invalid(self):
+        schema = {'mergeStrategy': 'version',
+                  'mergeOptions': {'dupsWindow': 0}}
+
+        merger = jsonmerge.Merger(schema)
+
+        with self.assertRaises(SchemaError):
+            merger.merge(None, "a")
+
+    def test_version_hash_values(self):
+        schema = {'mergeStrategy': 'version',
+                  'mergeOptions': {'hashValues': True}}
+
+        merger = jsonmerge.Merger(schema)
+
+        base = None
+        base = merger.merge(base, {'a': 1, 'b': [1, 2]})
+        base = merger.merge(base, {'b': [1, 2], 'a': 1})
+
+        self.assertEqual(len(base), 1)
+        self.assertEqual(base[0]['value'], {'a': 1, 'b': [1, 2]})
+        self.assertEqual(base[0]['valueHash'],
+                jsonmerge.jsonvalue.canonical_hash({'b': [1, 2], 'a': 1}))
+
+        base = merger.merge(base, {'a': 2, 'b': [1, 2]})
+
+        self.assertEqual(len(base), 2)
+
+    def test_version_hash_values_stored(self):
+        schema = {'mergeStrategy': 'version',
+                  'mergeOptions': {'hashValues': True}}
+
+        merger = jsonmerge.Merger(schema)
+
+        # Stored hash is used instead of the value.
+        base = [{'value': 'a', 'valueHash': jsonmerge.jsonvalue.canonical_hash('b')}]
+        base = merger.merge(base, 'b')
+
+        self.assertEqual(len(base), 1)
+
+        # Hash is computed for versions without it.
+        base = [{'value': 'a'}]
+        base = merger.merge(base, 'a')
+
+        self.assertEqual(base, [{'value': 'a'}])
+
     def test_version_unique_false(self):
 
         schema = {'mergeStrategy': 'version',
@@ -149,6 +224,183 @@ class TestMerge(unittest.TestCase):
 
         self.assertEqual(base, [{'value': "b"}])
 
+    def test_version_limit(self):
+
+        schema = {'mergeStrategy': 'version',
+                  'mergeOptions': {'limit': 3}}
+
+        merger = jsonmerge.Merger(schema)
+
+        base = None
+        for i in range(5):
+            prev = base
+            base = merger.merge(base, i)
+
+            if prev is not None:
+                self.assertIsNot(base, prev)
+                self.assertEqual(len(prev), min(i, 3))
+
+        self.assertEqual(base, [{'value': 2}, {'value': 3}, {'value': 4}])
+
+        # Unchanged base is not copied
+        self.assertIs(merger.merge(base, 4), base)
+
+    def test_version_limit_inplace(self):
+
+        schema = {'mergeStrategy': 'version',
+                  'mergeOptions': {'limit': 3}}
+
+        merger = jsonmerge.Merger(schema)
+
+        base = []
+        for i in range(5):
+            rv = merger.merge(base, i, inplace=True)
+            self.assertIs(rv, base)
+
+        self.assertEqual(base, [{'value': 2}, {'value': 3}, {'value': 4}])
+
+    def test_version_limit_longer_base(self):
+
+        schema = {'mergeStrategy': 'version',
+                  'mergeOptions': {'limit': 2}}
+
+        merger = jsonmerge.Merger(schema)
+
+        base = [{'value': 0}, {'value': 1}, {'value': 2}]
+        base = merger.merge(base, 3)
+
+        self.assertEqual(base, [{'value': 2}, {'value': 3}])
+
+    def test_version_history_store(self):
+
+        schema = {'properties': {
+                      'a': {'mergeStrategy': 'version'}
+                  }}
+
+        store = jsonmerge.history.SQLiteHistoryStore(':memory:')
+        merger = jsonmerge.Merger(schema)
+
+        merge_options = {'version': {'historyStore': store, 'historyKey': 'doc1'}}
+
+        base = None
+        for v in ("a", "b", "b", "c"):
+            base = merger.merge(base, {'a': v}, merge_options=merge_options)
+
+        self.assertEqual(base, {'a': [{'value': "c"}]})
+        self.assertEqual(list(store.read('doc1', '#/a')),
+                [{'value': "a"}, {'value': "b"}, {'value': "c"}])
+
+    def test_version_history_store_limit(self):
+
+        schema = {'mergeStrategy': 'version',
+                  'mergeOptions': {'limit': 2}}
+
+        store = jsonmerge.history.SQLiteHistoryStore(':memory:')
+        merger = jsonmerge.Merger(schema)
+
+        merge_options = {'version': {'historyStore': store}}
+
+        base = None
+        for v in ("a", "b", "c"):
+            base = merger.merge(base, v, merge_options=merge_options)
+
+        self.assertEqual(base, [{'value': "b"}, {'value': "c"}])
+        self.assertEqual(store.count(None, '#'), 3)
+
+    def test_version_history_store_invalid(self):
+
+        schema = {'mergeStrategy': 'version',
+                  'mergeOptions': {'historyStore': 'foo'}}
+
+        merger = jsonmerge.Merger(schema)
+
+        with self.assertRaises(SchemaError):
+            merger.merge(None, "a")
+
+    def test_version_delta(self):
+
+        schema = {'mergeStrategy': 'versionDelta'}
+
+        merger = jsonmerge.Merger(schema)
+
+        values = [{'a': 1, 'b': [1, 2]}, {'a': 2, 'b': [1, 2]}, {'b': [1, 3, 4]}]
+
+        base = None
+        for v in values:
+            base = merger.merge(base, v)
+
+        self.assertEqual(base, [
+            {'delta': {'object': {'a': {'replace': 1}}}},
+            {'delta': {'object': {'a': {'replace': 2},
+                                  'b': {'items': {'1': {'replace': 2}},
+                                        'truncate': 2}}}},
+            {'value': {'b': [1, 3, 4]}}])
+
+        self.assertEqual([ e['value'] for e in jsonmerge.delta.reconstruct(base) ], values)
+
+    def test_version_delta_dups(self):
+
+        schema = {'mergeStrategy': 'versionDelta'}
+
+        merger = jsonmerge.Merger(schema)
+
+        base = None
+        for v in ("a", "b", "b"):
+            base = merger.merge(base, v)
+
+        self.assertEqual(base, [{'delta': {'replace': "a"}}, {'value': "b"}])
+
+    def test_version_delta_dups_window(self):
+
+        schema = {'mergeStrategy': 'versionDelta',
+                  'mergeOptions': {'hashValues': True, 'dupsWindow': 3}}
+
+        merger = jsonmerge.Merger(schema)
+
+        base = None
+        for v in ({'a': 1}, {'a': 2}, {'a': 1}):
+            base = merger.merge(base, v)
+
+        self.assertEqual(len(base), 2)
+        self.assertEqual(base[-1]['value'], {'a': 2})
+        self.assertNotIn('value', base[0])
+
+    def test_version_delta_limit_metadata(self):
+
+        schema = {'mergeStrategy': 'versionDelta',
+                  'mergeOptions': {'limit': 2, 'metadata': {'v': 1}}}
+
+        merger = jsonmerge.Merger(schema)
+
+        base = None
+        for v in ("a", "b", "c"):
+            base = merger.merge(base, v)
+
+        self.assertEqual(base, [{'v': 1, 'delta': {'replace': "b"}}, {'v': 1, 'value': "c"}])
+
+    def test_version_delta_does_not_modify_base(self):
+
+        schema = {'mergeStrategy': 'versionDelta'}
+
+        merger = jsonmerge.Merger(schema)
+
+        base = [{'value': "a"}]
+        merger.merge(base, "b")
+
+        self.assertEqual(base, [{'value': "a"}])
+
+    def test_version_delta_inplace(self):
+
+        schema = {'mergeStrategy': 'versionDelta'}
+
+        merger = jsonmerge.Merger(schema)
+
+        base = [{'value': "a"}]
+        rv = merger.merge(base, "b", inplace=True)
+
+        self.assertIs(rv, base)
+        self.assertEqual(base, [{'delta': {'replace': "a"}}, {'value': "b"}])
+
     def test_version_base_not_a_list(self):
 
         schema = {'mergeStrategy': 'version'}
@@ -217,6 +469,70 @@ class TestMerge(unittest.TestCase):
 
         self.assertEqual(base, ['c', 'b', 'a'])
 
+    def test_append_with_sort_inplace(self):
+        schema = {'mergeStrategy': 'append',
+                  'mergeOptions': { 'sortByRef': 'name'}}
+
+        merger = jsonmerge.Merger(schema)
+
+        base = []
+        for head in ([{"name": "c"}, {"name": "a"}],
+                     [{"name": "b", "i": 1}],
+                     [{"item": "d"}, {"name": "b", "i": 2}],
+                     [{"name": "a", "i": 3}]):
+            base = merger.merge(base, head, inplace=True)
+
+        self.assertEqual(base, [
+            {"name": "a"},
+            {"name": "a", "i": 3},
+            {"name": "b", "i": 1},
+            {"name": "b", "i": 2},
+            {"name": "c"},
+            {"item": "d"},
+        ])
+
+    def test_append_with_sort_inplace_reversed(self):
+        schema = {'mergeStrategy': 'append',
+                  'mergeOptions': { 'sortByRef': '/',
+                                    'sortReverse': True}}
+
+        merger = jsonmerge.Merger(schema)
+
+        base = []
+        for head in (['a', 'c'], ['b'], ['d', 'a']):
+            base = merger.merge(base, head, inplace=True)
+
+        self.assertEqual(base, ['d', 'c', 'b', 'a', 'a'])
+
+    def test_append_with_sort_inplace_changed(self):
+        schema = {'mergeStrategy': 'append',
+                  'mergeOptions': { 'sortByRef': '/'}}
+
+        merger = jsonmerge.Merger(schema)
+
+        base = merger.merge([], ['a', 'c'], inplace=True)
+
+        # Array changed outside of merge
+        base[0] = 'd'
+
+        base = merger.merge(base, ['b'], inplace=True)
+
+        self.assertEqual(base, ['b', 'c', 'd'])
+
+        schema = {'mergeStrategy': 'append',
+                  'mergeOptions': { 'sortByRef': 'k'}}
+
+        merger = jsonmerge.Merger(schema)
+
+        base = merger.merge([], [{'k': 1}, {'k': 5}], inplace=True)
+
+        # Item changed outside of merge
+        base[0]['k'] = 10
+
+        base = merger.merge(base, [{'k': 3}], inplace=True)
+
+        self.assertEqual(base, [{'k': 3}, {'k': 5}, {'k': 10}])
+
     def test_append_with_sort_invalid_ref(self):
         schema = {'mergeStrategy': 'append',
                   'mergeOptions': { 'sortByRef': 'name'}}
@@ -265,6 +581,90 @@ class TestMerge(unittest.TestCase):
 
         self.assertEqual(cm.exception.value.ref, "#")
 
+    def test_append_unique(self):
+        schema = {'mergeStrategy': 'appendUnique'}
+
+        base = None
+        base = jsonmerge.merge(base, ["a", 1, {'b': [1, 2]}], schema)
+        base = jsonmerge.merge(base, [1, "c", {'b': [1, 2]}, [1], "c", [1]], schema)
+
+        self.assertEqual(base, ["a", 1, {'b': [1, 2]}, "c", [1]])
+
+    def test_append_unique_types(self):
+        schema = {'mergeStrategy': 'appendUnique'}
+
+        base = jsonmerge.merge([1, {'a': 1}], [1.0, True, "1", None, {'a': 1.0}, None], schema)
+
+        self.assertEqual(base, [1, {'a': 1}, 1.0, True, "1", None, {'a': 1.0}])
+        self.assertIs(type(base[2]), float)
+        self.assertIs(type(base[3]), bool)
+
+    def test_append_unique_keeps_base(self):
+        schema = {'mergeStrategy': 'appendUnique'}
+
+        base = jsonmerge.merge(["a", "a"], ["a", "b"], schema)
+
+        self.assertEqual(base, ["a", "a", "b"])
+
+    def test_append_unique_with_sort(self):
+        schema = {'mergeStrategy': 'appendUnique',
+                  'mergeOptions': {'sortByRef': '/'}}
+
+        base = jsonmerge.merge(["c", "a"], ["b", "a", "d"], schema)
+
+        self.assertEqual(base, ["a", "b", "c", "d"])
+
+    def test_append_unique_inplace(self):
+        schema = {'properties': {
+                    'tags': {'mergeStrategy': 'appendUnique'}}}
+
+        merger = jsonmerge.Merger(schema)
+
+        base = {}
+        for head in (["a", "b"], ["b", "c"], ["a", "d"]):
+            base = merger.merge(base, {'tags': head}, inplace=True)
+
+        self.assertEqual(base, {'tags': ["a", "b", "c", "d"]})
+
+    def test_append_unique_inplace_changed(self):
+        schema = {'mergeStrategy': 'appendUnique'}
+
+        merger = jsonmerge.Merger(schema)
+
+        base = merger.merge([], ["a", "b"], inplace=True)
+
+        # Array changed outside of merge
+        base.remove("a")
+
+        base = merger.merge(base, ["a"], inplace=True)
+
+        self.assertEqual(base, ["b", "a"])
+
+    def test_append_unique_inplace_item_changed(self):
+        schema = {'mergeStrategy': 'appendUnique'}
+
+        merger = jsonmerge.Merger(schema)
+
+        base = merger.merge([], [{'a': 1}], inplace=True)
+
+        # Item changed outside of merge
+        base[0]['a'] = 2
+
+        base = merger.merge(base, [{'a': 1}], inplace=True)
+
+        self.assertEqual(base, [{'a': 2}, {'a': 1}])
+
+    def test_append_unique_inplace_other_base(self):
+        schema = {'mergeStrategy': 'appendUnique'}
+
+        merger = jsonmerge.Merger(schema)
+
+        merger.merge([], [1, 2], inplace=True)
+
+        base = merger.merge([True, 2], [1], inplace=True)
+
+        self.assertEqual(base, [True, 2, 1])
+
     def test_merge_default(self):
         schema = {}
         base = None
@@ -447,6 +847,46 @@ class TestMerge(unittest.TestCase):
 
         self.assertEqual(base, {'a': ["a", "b"], 'b': 'c'})
 
+    def test_merge_pattern_last_match(self):
+
+        schema = {'patternProperties': {
+                      '^a': {'mergeStrategy': 'append'},
+                      'b$': {'mergeStrategy': 'version'}
+                  },
+                  'additionalProperties': {'mergeStrategy': 'discard'}}
+
+        merger = jsonmerge.Merger(schema)
+
+        base = None
+        for i in range(3):
+            base = merger.merge(base, {'ab': [i], 'a': [i], 'b': i, 'c': i})
+
+        self.assertEqual(base, {
+            'ab': [{'value': [0]}, {'value': [1]}, {'value': [2]}],
+            'a': [0, 1, 2],
+            'b': [{'value': 0}, {'value': 1}, {'value': 2}]})
+
+    def test_merge_many_keys(self):
+
+        schema = {'properties': {'a': {'mergeStrategy': 'append'}},
+                  'patternProperties': {
+                      '^u[0-9]+$': {'mergeStrategy': 'version'}
+                  }}
+
+        merger = jsonmerge.Merger(schema)
+
+        n = jsonmerge.plan.PlanNode.MAX_PROPERTIES * 2 + 1
+
+        head = dict(('u%d' % i, i) for i in range(n))
+        head['a'] = [1]
+
+        base = merger.merge(None, head)
+        base = merger.merge(base, head)
+
+        self.assertEqual(base['a'], [1, 1])
+        for i in range(n):
+            self.assertEqual(base['u%d' % i], [{'value': i}])
+
     def test_merge_append_additional(self):
 
         schema = {'mergeStrategy': 'objectMerge',
@@ -563,36 +1003,109 @@ class TestMerge(unittest.TestCase):
 
         self.assertEqual(base, {"a": {"b": [{"value": "c"}, {"value": "d"}]}})
 
-    def test_external_refs(self):
-
-        schema_1 = {
-            'id': 'http://example.com/schema_1.json',
-            'properties': {
-                'a': {'$ref': "schema_2.json#/definitions/a"},
-            },
-        }
-
-        schema_2 = {
-            'id': 'http://example.com/schema_2.json',
-            'definitions': {
-                "a": {
-                    "properties": {
-                        "b": {'mergeStrategy': 'version'},
-                    }
+    def test_does_not_modify_schema(self):
+        schema = {
+                'properties': {
+                    'a': {'$ref': '#/definitions/item'},
+                    'b': {
+                        'mergeStrategy': 'arrayMergeById',
+                        'items': {'$ref': '#/definitions/item'}
+                    },
+                    'c': {
+                        'oneOf': [
+                            {'type': 'array', 'mergeStrategy': 'append', 'maxItems': 2},
+                            {'type': 'string'}
+                        ],
+                        'mergeOptions': {'discriminatorRef': '/'}
+                    },
                 },
-            }
+                'definitions': {
+                    'item': {
+                        'properties': {
+                            'd': {'mergeStrategy': 'version'}
+                        }
+                    }
+                }
         }
 
-        merger = jsonmerge.Merger(schema_1)
+        expected = copy.deepcopy(schema)
 
-        # merge() would otherwise make a HTTP request
-        merger.cache_schema(schema_2)
+        merger = jsonmerge.Merger(schema)
+        schema2 = merger.get_schema()
 
-        base = None
-        base = merger.merge(base, {"a": {"b": "c"}})
-        base = merger.merge(base, {"a": {"b": "d"}})
+        self.assertEqual(schema, expected)
+        self.assertEqual(schema2['definitions']['item']['properties']['d'],
+                {'type': 'array', 'items': {'properties': {'value': {}}}})
+        self.assertEqual(schema2['properties']['c'],
+                {'oneOf': [{'type': 'array'}, {'type': 'string'}]})
 
-        self.assertEqual(base, {"a": {"b": [{"value": "c"}, {"value": "d"}]}})
+        base = merger.merge(None, {'a': {'d': 1}})
+        self.assertEqual(base, {'a': {'d': [{'value': 1}]}})
+
+    def test_structural_sharing(self):
+        schema = {
+                'properties': {
+                    'a': {'$ref': '#/definitions/a'},
+                    'b': {'type': 'string'},
+                },
+                'definitions': {
+                    'a': {'mergeStrategy': 'version'},
+                    'c': {'type': 'string'}
+                }
+        }
+
+        merger = jsonmerge.Merger(schema)
+        schema2 = merger.get_schema()
+
+        self.assertIsNot(schema2['definitions'], schema['definitions'])
+        self.assertIs(schema2['definitions']['c'], schema['definitions']['c'])
+        self.assertIs(schema2['properties']['a'], schema['properties']['a'])
+
+    def test_cached(self):
+        schema = {'mergeStrategy': 'version'}
+
+        merger = jsonmerge.Merger(schema)
+
+        schema2 = merger.get_schema()
+        self.assertIs(merger.get_schema(), schema2)
+        self.assertIs(merger.get_schema(merge_options={}), schema2)
+
+        schema3 = merger.get_schema(merge_options={'version': {'limit': 1}})
+        self.assertEqual(schema3['maxItems'], 1)
+        self.assertIs(merger.get_schema(merge_options={'version': {'limit': 1}}), schema3)
+
+        self.assertNotIn('maxItems', merger.get_schema())
+
+    def test_external_refs(self):
+
+        schema_1 = {
+            'id': 'http://example.com/schema_1.json',
+            'properties': {
+                'a': {'$ref': "schema_2.json#/definitions/a"},
+            },
+        }
+
+        schema_2 = {
+            'id': 'http://example.com/schema_2.json',
+            'definitions': {
+                "a": {
+                    "properties": {
+                        "b": {'mergeStrategy': 'version'},
+                    }
+                },
+            }
+        }
+
+        merger = jsonmerge.Merger(schema_1)
+
+        # merge() would otherwise make a HTTP request
+        merger.cache_schema(schema_2)
+
+        base = None
+        base = merger.merge(base, {"a": {"b": "c"}})
+        base = merger.merge(base, {"a": {"b": "d"}})
+
+        self.assertEqual(base, {"a": {"b": [{"value": "c"}, {"value": "d"}]}})
 
     @unittest.skipIf(Draft6Validator is None, 'jsonschema too old')
     def test_external_refs_draft6(self):
@@ -736,6 +1249,256 @@ class TestMerge(unittest.TestCase):
         with self.assertRaises(HeadInstanceError) as cm:
             base = merger.merge(base, [3, 4])
 
+    def test_oneof_same_base(self):
+
+        schema = {
+            'oneOf': [
+                {
+                    'type': 'array',
+                    'maxItems': 2,
+                    'mergeStrategy': 'append'
+                },
+                {
+                    'type': 'array',
+                    'items': {'type': 'string'},
+                    'mergeStrategy': 'overwrite'
+                }
+            ]
+        }
+
+        merger = jsonmerge.Merger(schema)
+
+        base = ['a']
+
+        self.assertEqual(merger.merge(base, [2]), ['a', 2])
+        self.assertEqual(merger.merge(base, ['b', 'c', 'd']), ['b', 'c', 'd'])
+
+        with self.assertRaises(HeadInstanceError):
+            merger.merge(base, ['b'])
+
+    def test_oneof_modified_base(self):
+
+        schema = {
+            'oneOf': [
+                {
+                    'properties': {'a': {'type': 'integer'}},
+                    'mergeStrategy': 'overwrite'
+                },
+                {
+                    'properties': {'a': {'type': 'string'}},
+                    'mergeStrategy': 'objectMerge'
+                }
+            ]
+        }
+
+        merger = jsonmerge.Merger(schema)
+
+        base = {'a': 1}
+        self.assertEqual(merger.merge(base, {'b': 1}), {'b': 1})
+
+        # base now only validates against the second element
+        base['a'] = 'x'
+        self.assertEqual(merger.merge(base, {'b': 1}), {'a': 'x', 'b': 1})
+
+    def test_oneof_inplace(self):
+
+        schema = {
+            'oneOf': [
+                {
+                    'type': 'array',
+                    'maxItems': 2,
+                    'mergeStrategy': 'append'
+                },
+                {
+                    'type': 'array',
+                    'minItems': 3,
+                    'mergeStrategy': 'overwrite'
+                }
+            ]
+        }
+
+        merger = jsonmerge.Merger(schema)
+
+        base = [1]
+        base = merger.merge(base, [2], inplace=True)
+        self.assertEqual(base, [1, 2])
+
+        # base now only validates against the first element
+        with self.assertRaises(HeadInstanceError):
+            merger.merge(base, [3, 4, 5], inplace=True)
+
+        base.append(3)
+
+        # base now only validates against the second element
+        base = merger.merge(base, [3, 4, 5], inplace=True)
+        self.assertEqual(base, [3, 4, 5])
+
+    def test_oneof_discriminator(self):
+
+        schema = {
+            'oneOf': [
+                {
+                    'properties': {
+                        'kind': {'enum': ['a']},
+                        'v': {'mergeStrategy': 'append'}
+                    }
+                },
+                {
+                    'properties': {
+                        'kind': {'enum': ['b']},
+                        'v': {'mergeStrategy': 'version'}
+                    }
+                }
+            ],
+            'mergeOptions': {
+                'discriminatorRef': 'kind',
+                'discriminatorMap': {'a': 0, 'b': 1}
+            }
+        }
+
+        merger = jsonmerge.Merger(schema)
+
+        base = None
+        base = merger.merge(base, {'kind': 'a', 'v': [1]})
+        base = merger.merge(base, {'kind': 'a', 'v': [2]})
+
+        self.assertEqual(base, {'kind': 'a', 'v': [1, 2]})
+
+        base = None
+        base = merger.merge(base, {'kind': 'b', 'v': 1})
+        base = merger.merge(base, {'kind': 'b', 'v': 2})
+
+        self.assertEqual(base, {'kind': 'b', 'v': [{'value': 1}, {'value': 2}]})
+
+        with self.assertRaises(HeadInstanceError) as cm:
+            merger.merge(base, {'kind': 'a', 'v': [2]})
+
+        self.assertEqual(cm.exception.value.ref, '#')
+
+    def test_oneof_discriminator_validate(self):
+
+        schema = {
+            'oneOf': [
+                {'properties': {'kind': {'enum': ['a']}, 'v': {'type': 'string'}}},
+                {'properties': {'kind': {'enum': ['b']}, 'v': {'type': 'number'}}}
+            ],
+            'mergeOptions': {
+                'discriminatorRef': '/kind',
+                'discriminatorMap': {'a': 0, 'b': 1}
+            }
+        }
+
+        merger = jsonmerge.Merger(schema)
+
+        # Selected subschema is not validated by default
+        self.assertEqual(merger.merge(None, {'kind': 'a', 'v': 1}), {'kind': 'a', 'v': 1})
+
+        schema['mergeOptions']['discriminatorValidate'] = True
+        merger = jsonmerge.Merger(schema)
+
+        self.assertEqual(merger.merge(None, {'kind': 'a', 'v': 'x'}), {'kind': 'a', 'v': 'x'})
+
+        with self.assertRaises(HeadInstanceError):
+            merger.merge(None, {'kind': 'a', 'v': 1})
+
+    def test_oneof_discriminator_fallback(self):
+
+        schema = {
+            'oneOf': [
+                {'type': 'object', 'mergeStrategy': 'objectMerge'},
+                {'type': 'array', 'mergeStrategy': 'append'}
+            ],
+            'mergeOptions': {
+                'discriminatorRef': 'kind',
+                'discriminatorMap': {'a': 0}
+            }
+        }
+
+        merger = jsonmerge.Merger(schema)
+
+        self.assertEqual(merger.merge([1], [2]), [1, 2])
+        self.assertEqual(merger.merge({'x': 1}, {'kind': 'c'}), {'x': 1, 'kind': 'c'})
+
+    def test_oneof_discriminator_bad_map(self):
+
+        schema = {
+            'oneOf': [
+                {'type': 'object'},
+            ],
+            'mergeOptions': {
+                'discriminatorRef': 'kind',
+                'discriminatorMap': {'a': 1}
+            }
+        }
+
+        merger = jsonmerge.Merger(schema)
+
+        with self.assertRaises(SchemaError) as cm:
+            merger.merge(None, {'kind': 'a'})
+
+        self.assertEqual(cm.exception.value.ref, '#')
+
+    def test_oneof_index_type(self):
+
+        schema = {
+            'oneOf': [
+                {'type': 'array', 'mergeStrategy': 'append'},
+                {'type': ['object', 'null']},
+                {'enum': ['a', 'b']},
+                {'minLength': 2},
+            ]
+        }
+
+        merger = jsonmerge.Merger(schema)
+        index = merger.compile().root.one_of_index()
+
+        self.assertEqual(list(index.candidates([1])), [0, 3])
+        self.assertEqual(list(index.candidates({})), [1, 3])
+        self.assertEqual(list(index.candidates('a')), [2, 3])
+        self.assertEqual(list(index.candidates('c')), [3])
+
+    @unittest.skipIf(Draft6Validator is None, 'jsonschema too old')
+    def test_oneof_index_discriminator(self):
+
+        schema = {
+            'oneOf': [
+                {
+                    'properties': {
+                        'kind': {'enum': ['a', 'b']},
+                        'v': {'mergeStrategy': 'append'}
+                    },
+                    'required': ['kind']
+                },
+                {
+                    'properties': {
+                        'kind': {'const': 'c'},
+                        'v': {'mergeStrategy': 'version'}
+                    },
+                    'required': ['kind', 'v']
+                },
+            ]
+        }
+
+        merger = jsonmerge.Merger(schema, validatorclass=Draft6Validator)
+        index = merger.compile().root.one_of_index()
+
+        self.assertEqual(index.discriminator, ('kind', {'a': [0], 'b': [0], 'c': [1]}))
+
+        self.assertEqual(list(index.candidates({'kind': 'b'})), [0])
+        self.assertEqual(list(index.candidates({'kind': 'c'})), [])
+        self.assertEqual(list(index.candidates({'kind': 'c', 'v': 1})), [1])
+        self.assertEqual(list(index.candidates({'kind': 'd'})), [])
+        self.assertEqual(list(index.candidates({})), [])
+
+        base = None
+        base = merger.merge(base, {'kind': 'c', 'v': 1})
+        base = merger.merge(base, {'kind': 'c', 'v': 2})
+
+        self.assertEqual(base, {'kind': 'c', 'v': [{'value': 1}, {'value': 2}]})
+
+        with self.assertRaises(HeadInstanceError):
+            merger.merge(base, {'kind': 'd'})
+
     def test_anyof(self):
         schema = {
             'anyOf': [
@@ -794,53 +1557,280 @@ class TestMerge(unittest.TestCase):
 
         self.assertEqual(base, "foo")
 
-    def test_merge_by_id(self):
+    def test_custom_strategy_raw(self):
+
         schema = {
-            "properties": {
-                "awards": {
-                    "type": "array",
-                    "mergeStrategy": "arrayMergeById",
-                    "items": {
-                        "properties": {
-                            "id": {"type": "string"},
-                            "field": {"type": "number"},
-                        }
-                    }
+                'mergeStrategy': 'myStrategy',
+                'items': {
+                    'mergeStrategy': 'append'
                 }
-            }
         }
 
-        a = {
-            "awards": [
-                {"id": "A", "field": 1},
-                {"id": "B", "field": 2}
-            ]
-        }
+        class MyStrategy(jsonmerge.strategies.Strategy):
+            # merge lists item by item
+            def merge_raw(self, walk, base, head, schema, path, **kwargs):
+                subschema = schema.child('items')
 
-        b = {
-            "awards": [
-                {"id": "B", "field": 3},
-                {"id": "C", "field": 4}
-            ]
-        }
+                rv = []
+                for i, v in enumerate(head):
+                    rv.append(walk.descend_raw(subschema, base[i], v, path.child(i)))
 
-        expected = {
-            "awards": [
-                {"id": "A", "field": 1},
-                {"id": "B", "field": 3},
-                {"id": "C", "field": 4}
-            ]
+                return rv
+
+        merger = jsonmerge.Merger(schema=schema,
+                                  strategies={'myStrategy': MyStrategy()})
+
+        base = [[1], [2]]
+        base = merger.merge(base, [[3], [4]])
+
+        self.assertEqual(base, [[1, 3], [2, 4]])
+
+        with self.assertRaises(HeadInstanceError) as cm:
+            merger.merge(base, [[5], 6])
+
+        self.assertEqual(cm.exception.value.ref, '#/1')
+
+    def test_custom_strategy_descend(self):
+
+        schema = {
+                'mergeStrategy': 'myStrategy',
+                'properties': {
+                    'a': {
+                        'mergeStrategy': 'append'
+                    }
+                }
         }
 
-        merger = jsonmerge.Merger(schema)
+        class MyStrategy(jsonmerge.strategies.ObjectMerge):
+            def merge(self, walk, base, head, schema, **kwargs):
+                base = super(MyStrategy, self).merge(walk, base, head, schema, **kwargs)
+                base['b'] = walk.descend(JSONValue({}), base.get('b'), JSONValue(1))
+                return base
+
+        merger = jsonmerge.Merger(schema=schema,
+                                  strategies={'myStrategy': MyStrategy()})
 
         base = None
-        base = merger.merge(base, a)
-        base = merger.merge(base, b)
+        base = merger.merge(base, {'a': [1]})
+        base = merger.merge(base, {'a': [2]})
 
-        self.assertEqual(base, expected)
+        self.assertEqual(base, {'a': [1, 2], 'b': 1})
 
-    def test_merge_by_id_when_key_is_empty_should_do_nothing(self):
+    def test_merge_inplace(self):
+
+        schema = {
+                'properties': {
+                    'a': {'mergeStrategy': 'append'},
+                    'b': {'mergeStrategy': 'version', 'mergeOptions': {'limit': 2}},
+                    'c': {'mergeStrategy': 'arrayMergeById'},
+                }
+        }
+
+        merger = jsonmerge.Merger(schema)
+
+        base = {'a': [1], 'c': [{'id': 1, 'x': 1}]}
+        a = base['a']
+        c = base['c']
+        c1 = base['c'][0]
+
+        for i in range(3):
+            head = {'a': [i], 'b': i, 'c': [{'id': 1, 'y': i}, {'id': 2}], 'd': {'e': i}}
+            rv = merger.merge(base, head, inplace=True)
+            self.assertIs(rv, base)
+
+        self.assertIs(base['a'], a)
+        self.assertIs(base['c'], c)
+        self.assertIs(base['c'][0], c1)
+
+        self.assertEqual(base, {
+            'a': [1, 0, 1, 2],
+            'b': [{'value': 1}, {'value': 2}],
+            'c': [{'id': 1, 'x': 1, 'y': 2}, {'id': 2}],
+            'd': {'e': 2},
+        })
+
+    def test_merge_not_inplace(self):
+
+        schema = {
+                'properties': {
+                    'a': {'mergeStrategy': 'append'},
+                    'b': {'mergeStrategy': 'version'},
+                }
+        }
+
+        merger = jsonmerge.Merger(schema)
+
+        base = {'a': [1], 'b': [{'value': 1}], 'c': {'d': 1}}
+        rv = merger.merge(base, {'a': [2], 'b': 2, 'c': {'d': 2}})
+
+        self.assertEqual(base, {'a': [1], 'b': [{'value': 1}], 'c': {'d': 1}})
+        self.assertEqual(rv, {'a': [1, 2], 'b': [{'value': 1}, {'value': 2}], 'c': {'d': 2}})
+
+    def test_merge_inplace_unsupported(self):
+
+        schema = {
+                'mergeStrategy': 'myStrategy',
+                'properties': {
+                    'a': {'mergeStrategy': 'append'}
+                }
+        }
+
+        class MyStrategy(jsonmerge.strategies.ObjectMerge):
+            supports_inplace = False
+
+        merger = jsonmerge.Merger(schema=schema,
+                                  strategies={'myStrategy': MyStrategy()})
+
+        base = {'a': [1]}
+        a = base['a']
+        rv = merger.merge(base, {'a': [2], 'b': 1}, inplace=True)
+
+        self.assertEqual(base, {'a': [1, 2]})
+        self.assertIs(base['a'], a)
+        self.assertEqual(rv, {'a': [1, 2], 'b': 1})
+        self.assertIsNot(rv, base)
+
+    def test_custom_strategy_steps(self):
+
+        schema = {'mergeStrategy': 'myStrategy'}
+
+        class MyStrategy(jsonmerge.strategies.Strategy):
+            def merge_steps(self, walk, base, head, schema, path, **kwargs):
+                if base is jsonmerge.jsonvalue.UNDEF:
+                    base = []
+                else:
+                    base = list(base)
+
+                for i, v in enumerate(head):
+                    rv = yield Descend(schema.child('items'), jsonmerge.jsonvalue.UNDEF, v, path.child(i))
+                    base.append(rv)
+
+                yield base
+
+        merger = jsonmerge.Merger(schema=schema,
+                                  strategies={'myStrategy': MyStrategy()})
+
+        base = None
+        base = merger.merge(base, [{'a': 1}])
+        base = merger.merge(base, [{'b': 2}])
+
+        self.assertEqual(base, [{'a': 1}, {'b': 2}])
+
+    def test_merge_deep(self):
+
+        depth = sys.getrecursionlimit() * 2
+
+        def deep(leaf):
+            doc = leaf
+            for i in range(depth):
+                doc = {'a': doc, 'b': [{'id': i}]}
+            return doc
+
+        schema = {
+                'properties': {
+                    'a': {'$ref': '#'},
+                    'b': {'mergeStrategy': 'arrayMergeById'}
+                }
+        }
+
+        merger = jsonmerge.Merger(schema)
+        base = merger.merge(deep(1), deep(2))
+
+        for i in reversed(range(depth)):
+            self.assertEqual(base['b'], [{'id': i}])
+            base = base['a']
+
+        self.assertEqual(base, 2)
+
+    def test_merge_deep_error(self):
+
+        depth = sys.getrecursionlimit() * 2
+
+        base = head = 1
+        for i in range(depth):
+            base = {'a': base}
+            head = {'a': head}
+        base = {'a': base, 'b': []}
+        head = {'a': head, 'b': 1}
+
+        schema = {'properties': {'b': {'mergeStrategy': 'append'}}}
+
+        merger = jsonmerge.Merger(schema)
+        with self.assertRaises(HeadInstanceError) as cm:
+            merger.merge(base, head)
+
+        self.assertEqual(cm.exception.value.ref, '#/b')
+        self.assertEqual(cm.exception.strategy_name, 'append')
+
+    def test_error_ref_nested(self):
+
+        schema = {
+                'properties': {
+                    'a': {
+                        'properties': {
+                            'b/c': {
+                                'mergeStrategy': 'append'
+                            }
+                        }
+                    }
+                }
+        }
+
+        merger = jsonmerge.Merger(schema)
+
+        with self.assertRaises(HeadInstanceError) as cm:
+            merger.merge({'a': {'b/c': [1]}}, {'a': {'b/c': 2}})
+
+        self.assertEqual(cm.exception.value.ref, '#/a/b~1c')
+        self.assertEqual(cm.exception.strategy_name, 'append')
+
+    def test_merge_by_id(self):
+        schema = {
+            "properties": {
+                "awards": {
+                    "type": "array",
+                    "mergeStrategy": "arrayMergeById",
+                    "items": {
+                        "properties": {
+                            "id": {"type": "string"},
+                            "field": {"type": "number"},
+                        }
+                    }
+                }
+            }
+        }
+
+        a = {
+            "awards": [
+                {"id": "A", "field": 1},
+                {"id": "B", "field": 2}
+            ]
+        }
+
+        b = {
+            "awards": [
+                {"id": "B", "field": 3},
+                {"id": "C", "field": 4}
+            ]
+        }
+
+        expected = {
+            "awards": [
+                {"id": "A", "field": 1},
+                {"id": "B", "field": 3},
+                {"id": "C", "field": 4}
+            ]
+        }
+
+        merger = jsonmerge.Merger(schema)
+
+        base = None
+        base = merger.merge(base, a)
+        base = merger.merge(base, b)
+
+        self.assertEqual(base, expected)
+
+    def test_merge_by_id_when_key_is_empty_should_do_nothing(self):
         schema = {
             "properties": {
                 "awards": {
@@ -1357,6 +2347,157 @@ class TestMerge(unittest.TestCase):
 
         self.assertEqual(base, expected)
 
+    def test_append_subclass_merge(self):
+
+        class MyAppend(jsonmerge.strategies.Append):
+            def _merge(self, walk, base, head, schema, **kwargs):
+                base = super(MyAppend, self)._merge(walk, base, head, schema, **kwargs)
+                base.val.append('marker')
+                return base
+
+        schema = {
+                'mergeStrategy': 'myAppend',
+                'mergeOptions': { 'sortByRef': '' }
+        }
+
+        merger = jsonmerge.Merger(schema=schema,
+                                  strategies={'myAppend': MyAppend()})
+
+        base = merger.merge([ 'b' ], [ 'a' ])
+
+        self.assertEqual(base, [ 'a', 'b', 'marker' ])
+
+    def test_merge_by_id_subclass_merge(self):
+
+        class MyArrayMergeById(jsonmerge.strategies.ArrayMergeById):
+            def _merge(self, walk, base, head, schema, **kwargs):
+                base = super(MyArrayMergeById, self)._merge(walk, base, head, schema, **kwargs)
+                base.val.append({'id': 'marker'})
+                return base
+
+        class MyArrayMergeByIndex(jsonmerge.strategies.ArrayMergeByIndex):
+            def _merge(self, walk, base, head, schema, **kwargs):
+                base = super(MyArrayMergeByIndex, self)._merge(walk, base, head, schema, **kwargs)
+                base.val.append({'id': 'marker'})
+                return base
+
+        schema = {
+                'properties': {
+                    'a': {
+                        'mergeStrategy': 'myArrayMergeById',
+                        'items': {
+                            'properties': {
+                                'x': { 'mergeStrategy': 'append' }
+                            }
+                        }
+                    },
+                    'b': {
+                        'mergeStrategy': 'myArrayMergeByIndex'
+                    }
+                }
+        }
+
+        merger = jsonmerge.Merger(schema=schema,
+                                  strategies={
+                                      'myArrayMergeById': MyArrayMergeById(),
+                                      'myArrayMergeByIndex': MyArrayMergeByIndex()})
+
+        base = {
+                'a': [ {'id': 1, 'x': [1]} ],
+                'b': [ {'id': 1} ]
+        }
+
+        head = {
+                'a': [ {'id': 2}, {'id': 1, 'x': [2]} ],
+                'b': [ {'y': 1} ]
+        }
+
+        base = merger.merge(base, head)
+
+        self.assertEqual(base, {
+                'a': [ {'id': 1, 'x': [1, 2]}, {'id': 2}, {'id': 'marker'} ],
+                'b': [ {'id': 1, 'y': 1}, {'id': 'marker'} ]
+        })
+
+    def test_array_strategy_legacy_helpers(self):
+
+        class MyArrayMergeById(jsonmerge.strategies.ArrayMergeById):
+            def get_key(self, walk, item, idRef):
+                return self._resolve_ref(walk, item, idRef)
+
+        class MyPrepend(jsonmerge.strategies.ArrayStrategy):
+            def _merge(self, walk, base, head, schema, sortByRef=None, **kwargs):
+                base.val[:0] = head.val
+                self.sort_array(walk, base, sortByRef, True)
+                return base
+
+        schema = {
+                'properties': {
+                    'a': {
+                        'mergeStrategy': 'myArrayMergeById',
+                        'mergeOptions': { 'idRef': '/k' }
+                    },
+                    'b': {
+                        'mergeStrategy': 'myPrepend',
+                        'mergeOptions': { 'sortByRef': '/k' }
+                    }
+                }
+        }
+
+        merger = jsonmerge.Merger(schema=schema,
+                                  strategies={
+                                      'myArrayMergeById': MyArrayMergeById(),
+                                      'myPrepend': MyPrepend()})
+
+        base = {
+                'a': [ {'k': 1, 'x': 1} ],
+                'b': [ {'k': 1} ]
+        }
+
+        head = {
+                'a': [ {'k': 1, 'y': 1}, {'k': 2} ],
+                'b': [ {'k': 2}, {'k': 0} ]
+        }
+
+        base = merger.merge(base, head)
+
+        self.assertEqual(base, {
+                'a': [ {'k': 1, 'x': 1, 'y': 1}, {'k': 2} ],
+                'b': [ {'k': 2}, {'k': 1}, {'k': 0} ]
+        })
+
+    def test_merge_by_id_error_ref(self):
+
+        schema = {
+                'mergeStrategy': 'arrayMergeById',
+                'items': {
+                    'properties': {
+                        'x': {
+                            'mergeStrategy': 'append'
+                        }
+                    }
+                }
+        }
+
+        merger = jsonmerge.Merger(schema)
+
+        base = [ {'id': 1}, {'id': 2, 'x': 'notarray'}, {'id': 3} ]
+
+        with self.assertRaises(HeadInstanceError) as cm:
+            merger.merge(base, [ {'id': 9, 'x': 'notarray'} ])
+
+        self.assertEqual(cm.exception.value.ref, '#/0/x')
+
+        with self.assertRaises(HeadInstanceError) as cm:
+            merger.merge(base, [ {'id': 3, 'x': 'notarray'} ])
+
+        self.assertEqual(cm.exception.value.ref, '#/0/x')
+
+        with self.assertRaises(BaseInstanceError) as cm:
+            merger.merge(base, [ {'id': 2, 'x': [1]} ])
+
+        self.assertEqual(cm.exception.value.ref, '#/1/x')
+
     def test_merge_by_id_multiple_ids(self):
 
         schema = {
@@ -1460,198 +2601,583 @@ class TestMerge(unittest.TestCase):
         base = merger.merge(base, head)
         self.assertEqual(base, expected)
 
-    def test_append_with_maxitems(self):
+    def test_merge_by_id_multiple_ids_non_unique_head(self):
+
+        schema = {
+                'mergeStrategy': 'arrayMergeById',
+                'mergeOptions': { 'idRef': ['/a', '/b'] }
+        }
+
+        head = [
+                {'a': 1, 'b': 1},
+                {'a': 1, 'b': 2},
+                {'a': 1, 'b': 1},
+        ]
+
+        merger = jsonmerge.Merger(schema)
+
+        with self.assertRaises(HeadInstanceError) as cm:
+            merger.merge(None, head)
+
+        self.assertEqual(cm.exception.value.ref, '#/2')
+
+    def test_merge_by_id_complex_id_non_unique_base(self):
+
+        schema = {
+                'mergeStrategy': 'arrayMergeById',
+        }
+
+        base = [
+                {'id': {'a': 1}},
+                {'id': {'a': 2}},
+                {'id': {'a': 1}},
+        ]
+
+        head = [
+                {'id': {'a': 1}, 'b': 1},
+        ]
+
+        merger = jsonmerge.Merger(schema)
+
+        with self.assertRaises(BaseInstanceError) as cm:
+            merger.merge(base, head)
+
+        self.assertEqual(cm.exception.value.ref, '#/2')
+
+    def test_merge_by_id_with_sort_inplace(self):
+
+        schema = {
+                'mergeStrategy': 'arrayMergeById',
+                'mergeOptions': { 'sortByRef': 'k' }
+        }
+
+        merger = jsonmerge.Merger(schema)
+
+        base = []
+        base = merger.merge(base, [{'id': 1, 'k': 2}, {'id': 2, 'k': 1}], inplace=True)
+        base = merger.merge(base, [{'id': 3, 'k': 3}], inplace=True)
+
+        self.assertEqual(base, [{'id': 2, 'k': 1}, {'id': 1, 'k': 2}, {'id': 3, 'k': 3}])
+
+        # Merged item changes its position
+        base = merger.merge(base, [{'id': 2, 'k': 4}, {'id': 4, 'k': 0}], inplace=True)
+
+        self.assertEqual(base, [{'id': 4, 'k': 0}, {'id': 1, 'k': 2},
+                                {'id': 3, 'k': 3}, {'id': 2, 'k': 4}])
+
+    def test_merge_by_id_large(self):
+
+        schema = {
+                'mergeStrategy': 'arrayMergeById',
+        }
+
+        n = 20000
+
+        base = [ {'id': i, 'a': i} for i in range(n) ]
+        head = [ {'id': i, 'b': i} for i in reversed(range(0, n * 2, 2)) ]
+
+        merger = jsonmerge.Merger(schema)
+        base = merger.merge(base, head)
+
+        self.assertEqual(len(base), n + n // 2)
+        self.assertEqual(base[2], {'id': 2, 'a': 2, 'b': 2})
+        self.assertEqual(base[3], {'id': 3, 'a': 3})
+        self.assertEqual(base[n], {'id': n * 2 - 2, 'b': n * 2 - 2})
+
+    def test_append_with_maxitems(self):
+
+        schema = {
+            "mergeStrategy": "append",
+            "maxItems": 2,
+        }
+
+        merger = jsonmerge.Merger(schema)
+
+        head = ["a"]
+        base = None
+
+        base = merger.merge(base, head)
+        base = merger.merge(base, head)
+        base = merger.merge(base, head)
+
+        schema2 = merger.get_schema()
+
+        jsonschema.validate(head, schema2)
+        jsonschema.validate(base, schema2)
+
+    def test_append_with_unique(self):
+
+        schema = {
+            "mergeStrategy": "append",
+            "uniqueItems": True,
+        }
+
+        merger = jsonmerge.Merger(schema)
+
+        head = ["a"]
+        base = None
+
+        base = merger.merge(base, head)
+        base = merger.merge(base, head)
+
+        schema2 = merger.get_schema()
+
+        jsonschema.validate(head, schema2)
+        jsonschema.validate(base, schema2)
+
+    def test_slash_in_property_name(self):
+
+        base = {'a': 0}
+        head = {'b': {'c/d': 1}}
+
+        base = jsonmerge.merge(base, head)
+
+        self.assertEqual(base, {'a': 0, 'b': {'c/d': 1}})
+
+    def test_tilde_in_property_name(self):
+
+        base = {'a': 0}
+        head = {'~1': 1}
+
+        base = jsonmerge.merge(base, head)
+
+        self.assertEqual(base, {'a': 0, '~1': 1})
+
+    def test_discard(self):
+
+        schema = {'mergeStrategy': 'discard'}
+
+        base = "a"
+        base = jsonmerge.merge(base, "b", schema)
+
+        self.assertEqual(base, "a")
+
+    def test_discard_objectmerge_null(self):
+
+        schema = {
+                'properties': {
+                    'a': {
+                        'mergeStrategy': 'discard'
+                    }
+                } }
+
+        base = {}
+        head = {'a': 1}
+
+        base = jsonmerge.merge(base, head, schema)
+        self.assertEqual(base, {})
+
+    def test_discard_arraymergebyid(self):
+
+        schema = {
+                'mergeStrategy': 'arrayMergeById',
+                'items': {
+                    'mergeStrategy': 'discard'
+                } }
+
+        base = [ {'id': 1, 'val': 1} ]
+        head = [ {'id': 1, 'val': 2} ]
+
+        base = jsonmerge.merge(base, head, schema)
+        self.assertEqual(base, [{'id': 1, 'val': 1}])
+
+    def test_discard_arraymergebyid_null(self):
+
+        schema = {
+                'mergeStrategy': 'arrayMergeById',
+                'items': {
+                    'mergeStrategy': 'discard'
+                } }
+
+        base = [ ]
+        head = [ {'id': 1, 'val': 1} ]
+
+        base = jsonmerge.merge(base, head, schema)
+        self.assertEqual(base, [])
+
+    def test_discard_null_keep(self):
+
+        schema = {
+                'properties': {
+                    'a': {
+                        'mergeStrategy': 'discard',
+                        'mergeOptions': {
+                            'keepIfUndef': True
+                        }
+                    }
+                } }
+
+        base = {}
+        head = {'a': 1}
+
+        base = jsonmerge.merge(base, head, schema)
+        self.assertEqual(base, {'a': 1})
+
+        head = {'a': 2}
+
+        base = jsonmerge.merge(base, head, schema)
+        self.assertEqual(base, {'a': 1})
+
+    def test_bad_strategy(self):
+
+        schema = {
+                'properties': {
+                    'a': {
+                        'mergeStrategy': 'invalidStrategy'
+                    } } }
+
+        base = {'a': 1 }
+        head = {'a': 2 }
+
+        with self.assertRaises(SchemaError) as cm:
+            jsonmerge.merge(base, head, schema)
+
+        self.assertEqual(cm.exception.value.ref, '#/properties/a')
+
+    def test_compile(self):
+
+        schema = {
+                'properties': {
+                    'a': {
+                        '$ref': '#/definitions/a'
+                    }
+                },
+                'definitions': {
+                    'a': {
+                        'mergeStrategy': 'append'
+                    }
+                }
+        }
+
+        merger = jsonmerge.Merger(schema)
+        merger.compile()
+
+        base = None
+        base = merger.merge(base, {'a': [1]})
+        base = merger.merge(base, {'a': [2]})
+
+        self.assertEqual(base, {'a': [1, 2]})
+
+    def test_compile_bad_strategy(self):
+
+        schema = {
+                'properties': {
+                    'a': {
+                        'mergeStrategy': 'invalidStrategy'
+                    } } }
+
+        merger = jsonmerge.Merger(schema)
+
+        with self.assertRaises(SchemaError) as cm:
+            merger.compile()
+
+        self.assertEqual(cm.exception.value.ref, '#/properties/a')
+
+    def test_compile_cache_schema(self):
+
+        schema_1 = {
+            'id': 'http://example.com/schema_1.json',
+            'properties': {
+                'a': {'$ref': "schema_2.json#/definitions/a"},
+            },
+        }
+
+        schema_2 = {
+            'id': 'http://example.com/schema_2.json',
+            'definitions': {
+                "a": {
+                    "mergeStrategy": "append"
+                },
+            }
+        }
+
+        merger = jsonmerge.Merger(schema_1)
+
+        # External references are not resolved by compile()
+        merger.compile()
+        merger.cache_schema(schema_2)
+
+        base = merger.merge({"a": [1]}, {"a": [2]})
+
+        self.assertEqual(base, {"a": [1, 2]})
+
+    def test_merge_options_not_cached(self):
+
+        schema = {'mergeStrategy': 'version'}
+
+        merger = jsonmerge.Merger(schema)
+
+        base = None
+        base = merger.merge(base, "a")
+        base = merger.merge(base, "b", merge_options={
+                'version': {'metadata': {'rev': 2}}})
+        base = merger.merge(base, "c")
+
+        self.assertEqual(base, [
+            {'value': "a"},
+            {'value': "b", 'rev': 2},
+            {'value': "c"}])
+
+    def test_nan(self):
+        # float('nan') == float('nan') evaluates to false.
+        #
+        # https://github.com/avian2/jsonmerge/issues/39
+        base = {
+            "foo": 1,
+            "bar": float('nan')
+        }
+
+        head = {
+            "foo": 1,
+            "bar": float('nan')
+        }
+
+        base = jsonmerge.merge(base, head)
+
+    def test_merge_by_index(self):
+
+        schema = {
+                'mergeStrategy': 'arrayMergeByIndex'
+        }
+
+        base = [ {'a': 0 }, {'b': 1} ]
+        head = [ {'c': 2 }, {'d': 3} ]
+
+        result = jsonmerge.merge(base, head, schema)
+
+        self.assertEqual(result, [ {'a': 0, 'c': 2}, {'b': 1, 'd': 3} ])
+
+    def test_merge_by_index_empty(self):
+
+        schema = {
+                'mergeStrategy': 'arrayMergeByIndex'
+        }
+
+        base = [ ]
+        head = [ {'c': 2 }, {'d': 3} ]
+
+        result = jsonmerge.merge(base, head, schema)
+
+        self.assertEqual(result, [ {'c': 2}, {'d': 3} ])
+
+    def test_merge_by_index_longer_head(self):
 
         schema = {
-            "mergeStrategy": "append",
-            "maxItems": 2,
+                'mergeStrategy': 'arrayMergeByIndex',
+                'items': {'mergeStrategy': 'version'}
         }
 
-        merger = jsonmerge.Merger(schema)
-
-        head = ["a"]
-        base = None
-
-        base = merger.merge(base, head)
-        base = merger.merge(base, head)
-        base = merger.merge(base, head)
+        base = [ [{'value': 0}] ]
+        head = [ 1, 2, 3 ]
 
-        schema2 = merger.get_schema()
+        result = jsonmerge.merge(base, head, schema)
 
-        jsonschema.validate(head, schema2)
-        jsonschema.validate(base, schema2)
+        self.assertEqual(result, [ [{'value': 0}, {'value': 1}], [{'value': 2}], [{'value': 3}] ])
 
-    def test_append_with_unique(self):
+    def test_merge_by_index_shorter_head(self):
 
         schema = {
-            "mergeStrategy": "append",
-            "uniqueItems": True,
+                'mergeStrategy': 'arrayMergeByIndex'
         }
 
-        merger = jsonmerge.Merger(schema)
+        base = [ 1, 2, 3 ]
+        head = [ 4 ]
 
-        head = ["a"]
-        base = None
+        result = jsonmerge.merge(base, head, schema)
 
-        base = merger.merge(base, head)
-        base = merger.merge(base, head)
+        self.assertEqual(result, [ 4, 2, 3 ])
+        self.assertEqual(base, [ 1, 2, 3 ])
 
-        schema2 = merger.get_schema()
+    def test_merge_by_index_inplace(self):
 
-        jsonschema.validate(head, schema2)
-        jsonschema.validate(base, schema2)
+        schema = {
+                'mergeStrategy': 'arrayMergeByIndex'
+        }
 
-    def test_slash_in_property_name(self):
+        base = [ 1, 2 ]
+        result = jsonmerge.Merger(schema).merge(base, [ 3, 4, 5 ], inplace=True)
 
-        base = {'a': 0}
-        head = {'b': {'c/d': 1}}
+        self.assertIs(result, base)
+        self.assertEqual(base, [ 3, 4, 5 ])
 
-        base = jsonmerge.merge(base, head)
+    def test_merge_by_index_custom_key(self):
 
-        self.assertEqual(base, {'a': 0, 'b': {'c/d': 1}})
+        class MergeByValue(jsonmerge.strategies.ArrayMergeByIndex):
+            def iter_index_key_item(self, walk, jv, idRef):
+                for i, item in enumerate(jv):
+                    yield i, item.val, item
 
-    def test_tilde_in_property_name(self):
+        schema = {
+                'mergeStrategy': 'mergeByValue'
+        }
 
-        base = {'a': 0}
-        head = {'~1': 1}
+        merger = jsonmerge.Merger(schema, strategies={'mergeByValue': MergeByValue()})
 
-        base = jsonmerge.merge(base, head)
+        result = merger.merge([ 1, 2, 3 ], [ 3, 4 ])
 
-        self.assertEqual(base, {'a': 0, '~1': 1})
+        self.assertEqual(result, [ 1, 2, 3, 4 ])
 
-    def test_discard(self):
+    def test_is_type(self):
 
-        schema = {'mergeStrategy': 'discard'}
+        values = [None, True, False, 0, 1, 1.0, 1.5, "a", [], {}, OrderedDict()]
+        types = ["array", "boolean", "integer", "null", "number", "object", "string"]
 
-        base = "a"
-        base = jsonmerge.merge(base, "b", schema)
+        for cls in (jsonschema.Draft4Validator, Draft6Validator):
+            if cls is None:
+                continue
 
-        self.assertEqual(base, "a")
+            merger = jsonmerge.Merger({}, validatorclass=cls)
+            for t in types:
+                for v in values:
+                    self.assertEqual(merger.is_type(v, t), merger.validator.is_type(v, t))
 
-    def test_discard_objectmerge_null(self):
+    def test_is_type_unknown(self):
 
-        schema = {
-                'properties': {
-                    'a': {
-                        'mergeStrategy': 'discard'
-                    }
-                } }
+        merger = jsonmerge.Merger({})
 
-        base = {}
-        head = {'a': 1}
+        with self.assertRaises(jsonschema.exceptions.UnknownType):
+            merger.is_type(1, "foo")
 
-        base = jsonmerge.merge(base, head, schema)
-        self.assertEqual(base, {})
+    @unittest.skipIf(not hasattr(jsonschema.Draft4Validator, 'TYPE_CHECKER'), 'jsonschema too old')
+    def test_custom_type_checker(self):
 
-    def test_discard_arraymergebyid(self):
+        def is_array(checker, instance):
+            return isinstance(instance, (list, tuple))
 
-        schema = {
-                'mergeStrategy': 'arrayMergeById',
-                'items': {
-                    'mergeStrategy': 'discard'
-                } }
+        type_checker = jsonschema.Draft4Validator.TYPE_CHECKER.redefine("array", is_array)
+        validatorclass = jsonschema.validators.extend(jsonschema.Draft4Validator, type_checker=type_checker)
 
-        base = [ {'id': 1, 'val': 1} ]
-        head = [ {'id': 1, 'val': 2} ]
+        schema = {'mergeStrategy': 'append'}
+        merger = jsonmerge.Merger(schema, validatorclass=validatorclass)
 
-        base = jsonmerge.merge(base, head, schema)
-        self.assertEqual(base, [{'id': 1, 'val': 1}])
+        self.assertTrue(merger.is_type((1,), "array"))
+        self.assertEqual(merger.merge([1], (2,)), [1, 2])
 
-    def test_discard_arraymergebyid_null(self):
 
-        schema = {
-                'mergeStrategy': 'arrayMergeById',
-                'items': {
-                    'mergeStrategy': 'discard'
-                } }
+class TestMergerCache(unittest.TestCase):
 
-        base = [ ]
-        head = [ {'id': 1, 'val': 1} ]
+    def test_hit(self):
+        cache = jsonmerge.MergerCache()
 
-        base = jsonmerge.merge(base, head, schema)
-        self.assertEqual(base, [])
+        m1 = cache.get({'properties': {'a': {}, 'b': {}}})
+        m2 = cache.get({'properties': {'b': {}, 'a': {}}})
 
-    def test_discard_null_keep(self):
+        self.assertIs(m1, m2)
+        self.assertEqual(cache.hits, 1)
+        self.assertEqual(cache.misses, 1)
+        self.assertEqual(len(cache), 1)
 
-        schema = {
-                'properties': {
-                    'a': {
-                        'mergeStrategy': 'discard',
-                        'mergeOptions': {
-                            'keepIfUndef': True
-                        }
-                    }
-                } }
+    def test_validatorclass(self):
+        cache = jsonmerge.MergerCache()
 
-        base = {}
-        head = {'a': 1}
+        m1 = cache.get({})
+        m2 = cache.get({}, validatorclass=jsonschema.Draft3Validator)
 
-        base = jsonmerge.merge(base, head, schema)
-        self.assertEqual(base, {'a': 1})
+        self.assertIsNot(m1, m2)
+        self.assertIs(m2.validator.__class__, jsonschema.Draft3Validator)
 
-        head = {'a': 2}
+    def test_lru(self):
+        cache = jsonmerge.MergerCache(maxsize=2)
 
-        base = jsonmerge.merge(base, head, schema)
-        self.assertEqual(base, {'a': 1})
+        m1 = cache.get({'title': '1'})
+        cache.get({'title': '2'})
+        cache.get({'title': '1'})
+        cache.get({'title': '3'})
 
-    def test_bad_strategy(self):
+        self.assertEqual(len(cache), 2)
+        self.assertIs(cache.get({'title': '1'}), m1)
+        self.assertEqual(cache.misses, 3)
 
-        schema = {
-                'properties': {
-                    'a': {
-                        'mergeStrategy': 'invalidStrategy'
-                    } } }
+        cache.get({'title': '2'})
+        self.assertEqual(cache.misses, 4)
 
-        base = {'a': 1 }
-        head = {'a': 2 }
+    def test_schema_copied(self):
+        cache = jsonmerge.MergerCache()
 
-        with self.assertRaises(SchemaError) as cm:
-            jsonmerge.merge(base, head, schema)
+        schema = {'mergeStrategy': 'append'}
+        m1 = cache.get(schema)
 
-        self.assertEqual(cm.exception.value.ref, '#/properties/a')
+        schema['mergeStrategy'] = 'overwrite'
+        m2 = cache.get(schema)
 
-    def test_nan(self):
-        # float('nan') == float('nan') evaluates to false.
-        #
-        # https://github.com/avian2/jsonmerge/issues/39
-        base = {
-            "foo": 1,
-            "bar": float('nan')
-        }
+        self.assertIsNot(m1, m2)
+        self.assertEqual(m1.merge([1], [2]), [1, 2])
+        self.assertEqual(m2.merge([1], [2]), [2])
 
-        head = {
-            "foo": 1,
-            "bar": float('nan')
-        }
+    def test_not_serializable(self):
+        cache = jsonmerge.MergerCache()
 
-        base = jsonmerge.merge(base, head)
+        schema = {'mergeOptions': {'historyStore': object()}}
 
-    def test_merge_by_index(self):
+        self.assertIsNot(cache.get(schema), cache.get(schema))
+        self.assertEqual(cache.misses, 2)
+        self.assertEqual(len(cache), 0)
 
-        schema = {
-                'mergeStrategy': 'arrayMergeByIndex'
-        }
+    def test_clear(self):
+        cache = jsonmerge.MergerCache()
 
-        base = [ {'a': 0 }, {'b': 1} ]
-        head = [ {'c': 2 }, {'d': 3} ]
+        cache.get({})
+        cache.get({})
+        cache.clear()
 
-        result = jsonmerge.merge(base, head, schema)
+        self.assertEqual(len(cache), 0)
+        self.assertEqual(cache.hits, 0)
+        self.assertEqual(cache.misses, 0)
 
-        self.assertEqual(result, [ {'a': 0, 'c': 2}, {'b': 1, 'd': 3} ])
+    def test_merge(self):
+        jsonmerge.merger_cache.clear()
 
-    def test_merge_by_index_empty(self):
+        schema = {'mergeStrategy': 'append'}
 
+        base = None
+        for head in ([1], [2], [3]):
+            base = jsonmerge.merge(base, head, schema)
+
+        self.assertEqual(base, [1, 2, 3])
+        self.assertEqual(jsonmerge.merger_cache.misses, 1)
+        self.assertEqual(jsonmerge.merger_cache.hits, 2)
+
+    def test_merge_threads(self):
         schema = {
-                'mergeStrategy': 'arrayMergeByIndex'
+                'properties': {
+                    'a': {
+                        'oneOf': [
+                            {'$ref': '#/definitions/list'},
+                            {'type': 'string'}
+                        ]
+                    }
+                },
+                'definitions': {
+                    'list': {
+                        'type': 'array',
+                        'mergeStrategy': 'append'
+                    }
+                }
         }
 
-        base = [ ]
-        head = [ {'c': 2 }, {'d': 3} ]
+        # merge() must wait for other merges with the same Merger.
+        merger, lock = jsonmerge.merger_cache._get(schema)
 
-        result = jsonmerge.merge(base, head, schema)
+        results = []
+        def run(i):
+            for j in range(20):
+                results.append(jsonmerge.merge({'a': [i]}, {'a': [j]}, schema))
 
-        self.assertEqual(result, [ {'c': 2}, {'d': 3} ])
+        threads = [ threading.Thread(target=run, args=(i,)) for i in range(4) ]
+
+        with lock:
+            for t in threads:
+                t.start()
+
+            threads[0].join(0.1)
+            self.assertEqual(results, [])
+
+        for t in threads:
+            t.join()
 
+        self.assertEqual(len(results), 80)
+        for result in results:
+            self.assertEqual(len(result['a']), 2)
 
 class TestGetSchema(unittest.TestCase):
 
@@ -1663,6 +3189,22 @@ class TestGetSchema(unittest.TestCase):
 
         self.assertEqual(schema2, {'description': 'test'})
 
+
+    def test_deep(self):
+        depth = sys.getrecursionlimit() * 2
+
+        schema = {'mergeStrategy': 'append'}
+        for i in range(depth):
+            schema = {'properties': {'a': schema}}
+
+        merger = jsonmerge.Merger(schema)
+        schema2 = merger.get_schema()
+
+        for i in range(depth):
+            schema2 = schema2['properties']['a']
+
+        self.assertEqual(schema2, {})
+
     def test_default_object_merge_trivial(self):
         schema = {'type': 'object'}
 
@@ -1714,6 +3256,16 @@ class TestGetSchema(unittest.TestCase):
 
         self.assertEqual(schema2, {'type': 'array'})
 
+    def test_append_unique(self):
+        schema = {'type': 'array',
+                  'maxItems': 2,
+                  'mergeStrategy': 'appendUnique'}
+
+        merger = jsonmerge.Merger(schema)
+        schema2 = merger.get_schema()
+
+        self.assertEqual(schema2, {'type': 'array'})
+
     def test_version(self):
         schema = {'mergeStrategy': 'version'}
 
@@ -1858,6 +3410,50 @@ class TestGetSchema(unittest.TestCase):
                              'maxItems': 5
                          })
 
+    def test_version_hash_values(self):
+        schema = {'mergeStrategy': 'version',
+                  'mergeOptions': {'hashValues': True}}
+
+        merger = jsonmerge.Merger(schema)
+        schema2 = merger.get_schema()
+
+        self.assertEqual(schema2,
+                         {
+                             'type': 'array',
+                             'items': {
+                                 'properties': {
+                                     'value': {},
+                                     'valueHash': {'type': 'string'}
+                                 }
+                             }
+                         })
+
+    def test_version_history_store(self):
+        schema = {'mergeStrategy': 'version'}
+
+        store = jsonmerge.history.SQLiteHistoryStore(':memory:')
+        merger = jsonmerge.Merger(schema)
+        schema2 = merger.get_schema(merge_options={'version': {'historyStore': store}})
+
+        self.assertEqual(schema2['maxItems'], 1)
+
+    def test_version_delta(self):
+        schema = {'mergeStrategy': 'versionDelta'}
+
+        merger = jsonmerge.Merger(schema)
+        schema2 = merger.get_schema()
+
+        self.assertEqual(schema2,
+                         {
+                             'type': 'array',
+                             'items': {
+                                 'properties': {
+                                     'value': {},
+                                     'delta': {'type': 'object'}
+                                 }
+                             }
+                         })
+
     def test_object_merge_simple(self):
         schema = {'mergeStrategy': 'objectMerge'}
 
@@ -2025,6 +3621,58 @@ class TestGetSchema(unittest.TestCase):
 
         self.assertEqual(cm.exception.value.ref, '#/properties/foo')
 
+    def test_reference_in_meta_cached(self):
+
+        schema = {'properties': {
+                      'a': {'mergeStrategy': 'version'},
+                      'b': {'mergeStrategy': 'version'},
+                      'c': {'mergeStrategy': 'version'}
+                 }}
+
+        meta_schema = {
+            '$ref': 'http://example.com/schema_2.json#/definitions/meta'
+        }
+
+        schema_2 = {
+            'id': 'http://example.com/schema_2.json',
+            'definitions': {
+                'meta': {'type': 'object'}
+            }
+        }
+
+        merger = jsonmerge.Merger(schema)
+        merger.cache_schema(schema_2)
+
+        created = []
+
+        class CountingMerger(jsonmerge.Merger):
+            def __init__(self, *args, **kwargs):
+                created.append(args[0])
+                super(CountingMerger, self).__init__(*args, **kwargs)
+
+        orig_merger = jsonmerge.Merger
+        jsonmerge.Merger = CountingMerger
+        try:
+            mschema = merger.get_schema(merge_options={
+                'version': {'metadataSchema': meta_schema}})
+        finally:
+            jsonmerge.Merger = orig_merger
+
+        self.assertEqual(created, [meta_schema])
+
+        for k in ('a', 'b', 'c'):
+            self.assertEqual(mschema['properties'][k]['items'],
+                             {'type': 'object', 'properties': {'value': {}}})
+
+        # cache_schema() makes cached schemas outdated
+        schema_2['definitions']['meta'] = {'type': 'array'}
+        merger.cache_schema(schema_2)
+
+        mschema = merger.get_schema(merge_options={
+            'version': {'metadataSchema': meta_schema}})
+
+        self.assertEqual(mschema['properties']['a']['items']['type'], 'array')
+
     def test_reference_in_meta(self):
 
         schema = {'mergeStrategy': 'version'}
@@ -2502,6 +4150,29 @@ class TestGetSchema(unittest.TestCase):
 
         self.assertEqual(schema2, expected)
 
+    def test_oneof_discriminator(self):
+
+        schema = {
+            'oneOf': [
+                {'type': 'array', 'mergeStrategy': 'append'},
+                {'type': 'object'}
+            ],
+            'mergeOptions': {
+                'discriminatorRef': 'kind',
+                'discriminatorMap': {'a': 1}
+            }
+        }
+
+        merger = jsonmerge.Merger(schema)
+        schema2 = merger.get_schema()
+
+        self.assertEqual(schema2, {
+            'oneOf': [
+                {'type': 'array'},
+                {'type': 'object'}
+            ]
+        })
+
     def test_oneof_recursive(self):
         # Schema to merge all arrays with "append" strategy and all objects
         # with the default "objectMerge" strategy.
@@ -2527,7 +4198,22 @@ class TestGetSchema(unittest.TestCase):
         merger = jsonmerge.Merger(schema)
         schema2 = merger.get_schema()
 
-        self.assertEqual(schema2, schema)
+        self.assertEqual(schema2, {
+            "oneOf": [
+                {
+                    "type": "array",
+                },
+                {
+                    "type": "object",
+                    "additionalProperties": {
+                        "$ref": "#"
+                    }
+                },
+                {
+                    "type": "string"
+                },
+            ]
+        })
 
     def test_oneof_toplevel(self):
 
@@ -1,6 +1,6 @@
 # vim:ts=4 sw=4 expandtab softtabstop=4
 import unittest
-from jsonmerge.jsonvalue import JSONValue
+from jsonmerge.jsonvalue import JSONValue, Path, UNDEF, compile_pointer
 
 class TestJSONValue(unittest.TestCase):
 
@@ -118,3 +118,140 @@ class TestJSONValue(unittest.TestCase):
 
         self.assertEqual(v.val, ['a', 'b'])
         self.assertEqual(v.ref, '#')
+
+    def test_get_attr_nested(self):
+        v = JSONValue({'a': [{'b/c': 1}]})
+
+        va = v['a'][0]['b/c']
+        self.assertEqual(1, va.val)
+        self.assertEqual('#/a/0/b~1c', va.ref)
+
+    def test_get_attr_deep(self):
+        d = {}
+        for i in range(10000):
+            d = {'a': d}
+
+        v = JSONValue(d, '#/definitions')
+        for i in range(10000):
+            v = v['a']
+
+        self.assertEqual('#/definitions' + '/a'*10000, v.ref)
+
+    def test_items_ref(self):
+        v = JSONValue({'a': 1}, '#/b')
+
+        self.assertEqual([('a', '#/b/a')], [ (k, w.ref) for k, w in v.items() ])
+
+    def test_set_ref(self):
+        v = JSONValue({'a': 1})['a']
+        v.ref = '#/b'
+
+        self.assertEqual('#/b', v.ref)
+
+    def test_slots(self):
+        v = JSONValue('a')
+
+        with self.assertRaises(AttributeError):
+            v.foo = 1
+
+    def test_raw(self):
+        self.assertEqual(JSONValue('a').raw(), 'a')
+        self.assertIs(JSONValue(undef=True).raw(), UNDEF)
+
+class TestPath(unittest.TestCase):
+
+    def test_root(self):
+        p = Path()
+        self.assertEqual('#', p.ref)
+
+    def test_child(self):
+        p = Path().child('a').child(0)
+        self.assertEqual('#/a/0', p.ref)
+
+    def test_child_escape(self):
+        p = Path().child('a/b').child('~0')
+        self.assertEqual('#/a~1b/~00', p.ref)
+
+    def test_child_of_ref(self):
+        p = Path('#/definitions').child('a')
+        self.assertEqual('#/definitions/a', p.ref)
+
+    def test_deep(self):
+        p = Path()
+        for i in range(10000):
+            p = p.child('a')
+
+        self.assertEqual('#' + '/a'*10000, p.ref)
+
+    def test_value(self):
+        v = Path().child('a').value('b')
+        self.assertEqual('b', v.val)
+        self.assertEqual('#/a', v.ref)
+
+    def test_value_lazy(self):
+        p = Path().child('a')
+        v = p.value({'c': 1})['c']
+
+        self.assertEqual('#/a/c', v.ref)
+
+    def test_value_undef(self):
+        v = Path().child('a').value(UNDEF)
+        self.assertTrue(v.is_undef())
+        self.assertEqual('#/a', v.ref)
+
+    def test_base(self):
+        p = Path().child('a')
+        self.assertIs(p, p.base)
+
+    def test_child_base_key(self):
+        p = Path().child('a').child(0, 2).child('b')
+        self.assertEqual('#/a/0/b', p.ref)
+        self.assertEqual('#/a/2/b', p.base.ref)
+
+class TestCompilePointer(unittest.TestCase):
+
+    def test_simple(self):
+        get = compile_pointer('/a')
+        self.assertEqual(1, get({'a': 1}))
+
+    def test_no_slash(self):
+        get = compile_pointer('a')
+        self.assertEqual(1, get({'a': 1}))
+
+    def test_root(self):
+        get = compile_pointer('/')
+        self.assertEqual({'a': 1}, get({'a': 1}))
+
+    def test_nested(self):
+        get = compile_pointer('/a/1/b')
+        self.assertEqual(2, get({'a': [{'b': 1}, {'b': 2}]}))
+
+    def test_escape(self):
+        get = compile_pointer('/a~1b/c~0d/e%25f')
+        self.assertEqual(1, get({'a/b': {'c~d': {'e%f': 1}}}))
+
+    def test_numeric_key(self):
+        get = compile_pointer('/1')
+        self.assertEqual('b', get({'1': 'b'}))
+        self.assertEqual('c', get(['a', 'c']))
+
+    def test_missing(self):
+        get = compile_pointer('/a/b')
+        self.assertIs(UNDEF, get({}))
+        self.assertIs(UNDEF, get({'a': {}}))
+        self.assertIs(UNDEF, get({'a': 1}))
+        self.assertIs(UNDEF, get({'a': ['x']}))
+        self.assertIs(UNDEF, get(None))
+
+    def test_null(self):
+        get = compile_pointer('/a')
+        self.assertIs(None, get({'a': None}))
+
+    def test_list(self):
+        get = compile_pointer(['/a', 'b'])
+        self.assertEqual([1, 2], get({'a': 1, 'b': 2}))
+        self.assertIs(UNDEF, get({'a': 1}))
+
+    def test_cached(self):
+        self.assertIs(compile_pointer('/a'), compile_pointer('/a'))
+        self.assertIs(compile_pointer(['/a']), compile_pointer(['/a']))
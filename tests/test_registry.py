@@ -0,0 +1,145 @@
+# vim:ts=4 sw=4 expandtab softtabstop=4
+import io
+import json
+import os
+import shutil
+import tempfile
+import unittest
+import zipfile
+
+import jsonmerge
+import jsonschema
+from jsonmerge.registry import SchemaRegistry
+
+SCHEMAS = {
+    'a.json': {
+        'id': 'http://example.com/a.json',
+        'definitions': {
+            'version': {'mergeStrategy': 'version'}
+        }
+    },
+    'sub/b.json': {
+        '$id': 'http://example.com/b.json#',
+        'mergeStrategy': 'append'
+    },
+    'sub/no_id.json': {
+        'mergeStrategy': 'discard'
+    },
+    'notes.txt': 'not a schema',
+}
+
+class RegistryTests(object):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def write(self, path):
+        for name, schema in SCHEMAS.items():
+            self.add(path, name, json.dumps(schema))
+
+    def test_index(self):
+        with self.open() as registry:
+            self.assertEqual(registry.uris(),
+                    ['http://example.com/a.json', 'http://example.com/b.json'])
+            self.assertIn('http://example.com/b.json#', registry)
+            self.assertNotIn('http://example.com/c.json', registry)
+
+    def test_get(self):
+        with self.open() as registry:
+            self.assertEqual(registry.get('http://example.com/a.json'), SCHEMAS['a.json'])
+            self.assertIs(registry.get('http://example.com/a.json'),
+                    registry.get('http://example.com/a.json#'))
+
+            with self.assertRaises(KeyError):
+                registry.get('http://example.com/c.json')
+
+    def test_base_uri(self):
+        with self.open(base_uri='http://example.com/schemas/') as registry:
+            self.assertEqual(registry.get('http://example.com/schemas/sub/no_id.json'),
+                    SCHEMAS['sub/no_id.json'])
+
+    def test_merger(self):
+        schema = {
+            'properties': {
+                'a': {'$ref': 'http://example.com/a.json#/definitions/version'},
+                'b': {'$ref': 'http://example.com/b.json'}
+            }
+        }
+
+        with self.open() as registry:
+            merger = jsonmerge.Merger(schema, registry=registry)
+
+            base = merger.merge(None, {'a': 1, 'b': [1]})
+            base = merger.merge(base, {'a': 2, 'b': [2]})
+
+            self.assertEqual(base, {'a': [{'value': 1}, {'value': 2}], 'b': [1, 2]})
+
+    def test_merger_metadata_schema(self):
+        schema = {
+            'mergeStrategy': 'version',
+            'mergeOptions': {
+                'metadataSchema': {'$ref': 'http://example.com/a.json#/definitions/version'}
+            }
+        }
+
+        with self.open() as registry:
+            merger = jsonmerge.Merger(schema, registry=registry)
+            schema2 = merger.get_schema()
+
+            self.assertEqual(schema2['items']['mergeStrategy'], 'version')
+
+    def test_merger_not_found(self):
+        schema = {'$ref': 'http://example.com/c.json'}
+
+        with self.open() as registry:
+            merger = jsonmerge.Merger(schema, registry=registry)
+
+            with self.assertRaises(jsonschema.RefResolutionError) as cm:
+                merger.merge(None, 1)
+
+            self.assertIn('not found in registry', str(cm.exception))
+
+class TestDirectoryRegistry(RegistryTests, unittest.TestCase):
+
+    def add(self, path, name, data):
+        path = os.path.join(path, *name.split('/'))
+        if not os.path.isdir(os.path.dirname(path)):
+            os.makedirs(os.path.dirname(path))
+
+        with io.open(path, 'w', encoding='utf-8') as f:
+            f.write(data)
+
+    def open(self, **kwargs):
+        path = os.path.join(self.dir, 'schemas')
+        os.mkdir(path)
+        self.write(path)
+
+        return SchemaRegistry(path, **kwargs)
+
+    def test_bad_path(self):
+        path = os.path.join(self.dir, 'a.json')
+
+        with self.assertRaises(IOError):
+            SchemaRegistry(path)
+
+        self.add(self.dir, 'a.json', '{}')
+
+        with self.assertRaises(IOError):
+            SchemaRegistry(path)
+
+class TestZipRegistry(RegistryTests, unittest.TestCase):
+
+    def add(self, path, name, data):
+        self.zip.writestr(name, data)
+
+    def open(self, **kwargs):
+        path = os.path.join(self.dir, 'schemas.zip')
+
+        self.zip = zipfile.ZipFile(path, 'w')
+        self.write(path)
+        self.zip.close()
+
+        return SchemaRegistry(path, **kwargs)
@@ -0,0 +1,102 @@
+# vim:ts=4 sw=4 expandtab softtabstop=4
+import unittest
+
+import jsonmerge
+from jsonmerge.resolver import LocalRefResolver
+
+class TestLocalRefResolver(unittest.TestCase):
+
+    def setUp(self):
+        self.schema = {
+            'definitions': {
+                'a': {'type': 'string'}
+            }
+        }
+        self.resolver = LocalRefResolver.from_schema(self.schema)
+
+    def test_resolve(self):
+        url, resolved = self.resolver.resolve('#/definitions/a')
+
+        self.assertIs(resolved, self.schema['definitions']['a'])
+
+    def test_cached(self):
+        rv = self.resolver.resolve('#/definitions/a')
+
+        # Changes to the schema are not seen until invalidate() is called.
+        self.schema['definitions']['a'] = {'type': 'integer'}
+        self.assertIs(self.resolver.resolve('#/definitions/a'), rv)
+
+        self.resolver.invalidate()
+        self.assertEqual(self.resolver.generation, 1)
+
+        url, resolved = self.resolver.resolve('#/definitions/a')
+        self.assertEqual(resolved, {'type': 'integer'})
+
+    def test_scope(self):
+        self.resolver.store['http://example.com/b.json'] = {'definitions': {'a': {'type': 'null'}}}
+
+        url, resolved = self.resolver.resolve('#/definitions/a')
+        self.assertEqual(resolved, {'type': 'string'})
+
+        self.resolver.push_scope('http://example.com/b.json')
+        try:
+            url, resolved = self.resolver.resolve('#/definitions/a')
+        finally:
+            self.resolver.pop_scope()
+
+        self.assertEqual(resolved, {'type': 'null'})
+
+    def test_is_remote_ref(self):
+        self.assertFalse(self.resolver.is_remote_ref('#/definitions/a'))
+        self.assertTrue(self.resolver.is_remote_ref('http://example.com/b.json#/a'))
+
+    def test_cache_schema(self):
+        schema = {'$ref': 'http://example.com/b.json'}
+
+        merger = jsonmerge.Merger(schema)
+        merger.cache_schema({'mergeStrategy': 'append'}, 'http://example.com/b.json')
+        self.assertEqual(merger.merge([1], [2]), [1, 2])
+
+        merger.cache_schema({'mergeStrategy': 'overwrite'}, 'http://example.com/b.json')
+        self.assertEqual(merger.merge([1], [2]), [2])
+
+    def test_merger_invalidate(self):
+        schema = {'$ref': 'http://example.com/b.json'}
+
+        merger = jsonmerge.Merger(schema)
+        resolver = merger.validator.resolver
+
+        resolver.store['http://example.com/b.json'] = {'mergeStrategy': 'append'}
+        self.assertEqual(merger.merge([1], [2]), [1, 2])
+
+        # The plan is rebuilt after the resolver is invalidated.
+        resolver.store['http://example.com/b.json'] = {'mergeStrategy': 'overwrite'}
+        self.assertEqual(merger.merge([1], [2]), [1, 2])
+
+        resolver.invalidate()
+        self.assertEqual(merger.merge([1], [2]), [2])
+
+    def test_merger_invalidate_get_schema(self):
+        schema = {
+            'mergeStrategy': 'version',
+            'mergeOptions': {
+                'metadataSchema': {'$ref': 'http://example.com/m.json'}
+            }
+        }
+
+        merger = jsonmerge.Merger(schema)
+        resolver = merger.validator.resolver
+
+        def metadata_type():
+            return merger.get_schema()['items']['properties']['x']['type']
+
+        resolver.store['http://example.com/m.json'] = {'properties': {'x': {'type': 'string'}}}
+        self.assertEqual(metadata_type(), 'string')
+
+        # Schemas returned by get_schema() are rebuilt after the resolver
+        # is invalidated.
+        resolver.store['http://example.com/m.json'] = {'properties': {'x': {'type': 'integer'}}}
+        self.assertEqual(metadata_type(), 'string')
+
+        resolver.invalidate()
+        self.assertEqual(metadata_type(), 'integer')